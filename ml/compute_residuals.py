@@ -16,7 +16,7 @@ SNR-based masking filters out noise-contaminated harmonics:
 - Harmonics with SNR < threshold are masked (NaN)
 - Anomalous patterns (H_{n+1} > H_n) are flagged and masked
 
-Output: ml_data/training_data.npz containing:
+Output: ml_data/training_data/ with one .npy per array (np.load(..., mmap_mode='r')):
 - inputs (N, 2): [midi_note_normalized, velocity_normalized]
 - targets (N, 11): correction values
 - mask (N, 11): True where target is valid
@@ -27,14 +27,19 @@ Usage:
 """
 
 import argparse
+import functools
+import hashlib
 import json
-import math
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+
 import numpy as np
 
-from render_model_notes import bucket_velocity
-from goertzel_utils import load_audio, extract_harmonics_fft
+from render_model_notes import bucket_velocity_array
+from goertzel_utils import (load_audio, magnitude_spectrum, segment_spectra,
+                            harmonics_from_spectrum, bin_range)
 
 N_HARMONICS = 8
 # v2 target vector layout (11 values):
@@ -55,13 +60,99 @@ SNR_THRESHOLD_DB = 10.0
 # H2 (idx 0) and H3 (idx 1) are potentially reliable; H4-H6 (idx 2-4) always masked
 MAX_RELIABLE_HARMONIC = 2  # Only H2 and H3 targets
 
+# Harmonics to measure SNR for: H1..H4 covers every SNR lookup for the
+# reliable targets (H2/H3) plus the per-note diagnostic table in main().
+# Shorter SNR arrays simply leave higher harmonics unfiltered, and those
+# targets are masked by MAX_RELIABLE_HARMONIC anyway.
+SNR_N_HARMONICS = MAX_RELIABLE_HARMONIC + 2
+
+# SNR measurement window relative to note onset (s)
+SNR_WINDOW_START_S = 0.05
+SNR_WINDOW_END_S = 0.20
+
+# Bump when FeatureColumns changes so cached "<json>.columns.npz" files are rebuilt
+FEATURE_CACHE_VERSION = 1
+
+# Bump when the SNR measurement changes so on-disk SNR caches are invalidated
+SNR_CACHE_VERSION = 1
+
+# Max equal-length SNR windows transformed per rfft call (bounds spectrum memory)
+SNR_BATCH_ROWS = 64
+
+
+def _band_medians(spectrum, lo, hi):
+    """np.median of spectrum[lo[i]:hi[i]] for every band i at once (inf if empty).
+
+    Bands are gathered into one +inf-padded matrix and partitioned on every
+    middle order statistic needed, so each row's two middle values land in
+    place in a single O(k) selection; averaging them matches np.median for
+    odd and even band widths.
+    """
+    widths = np.maximum(hi - lo, 0)
+    cols = np.arange(max(int(widths.max(initial=0)), 1))
+    idx = np.minimum(lo[:, None] + cols, len(spectrum) - 1)
+    bands = np.where(cols < widths[:, None], spectrum[idx], np.inf)
+    lo_mid = np.maximum(widths - 1, 0) // 2
+    hi_mid = widths // 2
+    bands.partition(np.unique(np.concatenate([lo_mid, hi_mid])), axis=1)
+    rows = np.arange(len(widths))
+    return (bands[rows, lo_mid] + bands[rows, hi_mid]) / 2
+
+
+def snr_from_spectrum(spectrum, freqs_axis, sr, f0, n_harmonics=8):
+    """Per-harmonic SNR from a magnitude_spectrum() of the measurement window.
+
+    For each harmonic H_n, measures the noise floor at (n+0.5)*f0.
+    SNR = 20*log10(H_n / noise_floor). f0 may be an array of fundamentals
+    of notes sharing the window; all their bands are measured in one pass.
+
+    Returns:
+        snr_db: array of SNR values in dB (n_harmonics,), or
+                (len(f0), n_harmonics) for an array f0
+    """
+    # Notes at the same pitch share every band: measure each distinct f0 once
+    f0s, f0_rows = np.unique(np.atleast_1d(np.asarray(f0, dtype=float)), return_inverse=True)
+    h_amps = np.array([harmonics_from_spectrum(spectrum, freqs_axis, sr, f, n_harmonics)[0]
+                       for f in f0s]).reshape(len(f0s), n_harmonics)
+
+    # Measure noise floor at inter-harmonic frequencies (h+0.5)*f0, i.e.
+    # between H_{h+1} and H_{h+2}, as the MEDIAN of +/-1% around each one
+    # (more robust than peak). Bands at/above Nyquist-100 Hz or with no
+    # bins get a 1e-20 floor.
+    noise_freqs = (np.arange(n_harmonics) + 1.5) * f0s[:, None]
+    lo, hi = bin_range(freqs_axis, noise_freqs * 0.99, noise_freqs * 1.01)
+    measurable = (noise_freqs < sr / 2 - 100) & (hi > lo)
+    medians = _band_medians(spectrum, lo.ravel(), hi.ravel()).reshape(lo.shape)
+    noise_amps = np.where(measurable, np.maximum(medians, 1e-20), 1e-20)
+
+    # SNR in dB
+    ok = (h_amps > 1e-20) & (noise_amps > 1e-20)
+    ratio = np.divide(h_amps, noise_amps, out=np.ones_like(h_amps), where=ok)
+    snr_db = np.where(ok, 20.0 * np.log10(ratio), np.nan)[f0_rows]
+
+    return snr_db if np.ndim(f0) else snr_db[0]
+
+
+def _snr_window_bounds(n_samples, sr, onset_s, window_start, window_end):
+    """Sample range (start, end) of an SNR measurement window, or None if < 128 samples."""
+    start_idx = int((onset_s + window_start) * sr)
+    end_idx = int((onset_s + window_end) * sr)
+
+    if start_idx < 0:
+        start_idx = 0
+    if end_idx > n_samples:
+        end_idx = n_samples
+    if end_idx - start_idx < 128:
+        return None
+    return start_idx, end_idx
+
 
 def measure_interharmonic_snr(audio, sr, f0, onset_s, n_harmonics=8,
-                               window_start=0.05, window_end=0.20):
+                               window_start=SNR_WINDOW_START_S, window_end=SNR_WINDOW_END_S):
     """Measure per-harmonic SNR using inter-harmonic noise floor.
 
-    For each harmonic H_n, measures the noise floor at (n+0.5)*f0.
-    SNR = 20*log10(H_n / noise_floor).
+    Slices the measurement window out of the full recording and hands its
+    spectrum to snr_from_spectrum().
 
     Args:
         audio: full audio array
@@ -73,159 +164,346 @@ def measure_interharmonic_snr(audio, sr, f0, onset_s, n_harmonics=8,
         window_end: end of measurement window (relative to onset)
 
     Returns:
-        snr_db: array of SNR values in dB (n_harmonics,)
+        snr_db: array of SNR values in dB (n_harmonics,), all NaN if the
+        window holds fewer than 128 samples
     """
-    start_idx = int((onset_s + window_start) * sr)
-    end_idx = int((onset_s + window_end) * sr)
-
-    if start_idx < 0:
-        start_idx = 0
-    if end_idx > len(audio):
-        end_idx = len(audio)
-    if end_idx - start_idx < 128:
+    bounds = _snr_window_bounds(len(audio), sr, onset_s, window_start, window_end)
+    if bounds is None:
         return np.full(n_harmonics, np.nan)
 
-    segment = audio[start_idx:end_idx]
-
-    # Measure harmonic amplitudes
-    h_amps, _ = extract_harmonics_fft(segment, sr, f0, n_harmonics)
-
-    # Measure noise floor at inter-harmonic frequencies (h+0.5)*f0
-    noise_amps = np.zeros(n_harmonics)
-    N = len(segment)
-    nfft = N * 4
-    window = np.hanning(N)
-    windowed = segment * window
-    spectrum = np.abs(np.fft.rfft(windowed, n=nfft))
-    spectrum = spectrum * 2.0 / N / 0.5
-    freqs_axis = np.fft.rfftfreq(nfft, d=1.0 / sr)
-
-    for h in range(n_harmonics):
-        noise_freq = (h + 1.5) * f0  # between H_{h+1} and H_{h+2}
-        if noise_freq >= sr / 2 - 100:
-            noise_amps[h] = 1e-20
-            continue
-        # Search +/-1% around noise frequency
-        f_lo = noise_freq * 0.99
-        f_hi = noise_freq * 1.01
-        mask = (freqs_axis >= f_lo) & (freqs_axis <= f_hi)
-        if not np.any(mask):
-            noise_amps[h] = 1e-20
-            continue
-        idx = np.where(mask)[0]
-        # Use MEDIAN of the region (more robust than peak)
-        noise_amps[h] = max(np.median(spectrum[idx]), 1e-20)
+    segment = audio[bounds[0]:bounds[1]]
 
-    # SNR in dB
-    snr_db = np.zeros(n_harmonics)
-    for h in range(n_harmonics):
-        if h_amps[h] > 1e-20 and noise_amps[h] > 1e-20:
-            snr_db[h] = 20.0 * np.log10(h_amps[h] / noise_amps[h])
-        else:
-            snr_db[h] = np.nan
+    # One windowed spectrum serves both the harmonic peaks and the noise floor
+    spectrum, freqs_axis = magnitude_spectrum(segment, sr)
+    return snr_from_spectrum(spectrum, freqs_axis, sr, f0, n_harmonics)
+
+
+def measure_interharmonic_snr_batch(audio, sr, f0s, onsets, n_harmonics=8,
+                                     window_start=SNR_WINDOW_START_S, window_end=SNR_WINDOW_END_S,
+                                     fft_workers=None, audio_offset=0):
+    """measure_interharmonic_snr for many notes of one recording.
 
+    Notes with the same measurement window share one spectrum, and windows
+    of equal length are stacked and transformed together (SNR_BATCH_ROWS
+    at a time to bound the spectrum buffer). fft_workers threads the stacked
+    rfft (-1 = all cores). audio_offset is the recording sample that audio[0]
+    holds, for audio loaded from an offset rather than the start of the file.
+
+    Returns:
+        snr_db: (len(f0s), n_harmonics) array, NaN rows for short windows
+    """
+    snr_db = np.full((len(f0s), n_harmonics), np.nan)
+    bounds = [_snr_window_bounds(audio_offset + len(audio), sr, onset_s, window_start, window_end)
+              for onset_s in onsets]
+
+    # Windows are in recording samples; shift them onto the loaded span
+    bounds = [None if b is None else (b[0] - audio_offset, b[1] - audio_offset) for b in bounds]
+    spectra = segment_spectra(audio, sr, filter(None, bounds), workers=fft_workers,
+                              batch_rows=SNR_BATCH_ROWS)
+
+    # All notes sharing a window are measured against its spectrum together
+    rows_by_window = {}
+    for i, b in enumerate(bounds):
+        if b is not None:
+            rows_by_window.setdefault(b, []).append(i)
+    f0s = np.asarray(f0s, dtype=float)
+    for b, rows in rows_by_window.items():
+        spectrum, freqs_axis = spectra[b]
+        snr_db[rows] = snr_from_spectrum(spectrum, freqs_axis, sr, f0s[rows], n_harmonics)
     return snr_db
 
 
-def detect_anomalous_harmonics(real_dB):
+def anomalous_harmonics(real_dB):
     """Detect physically impossible harmonic patterns.
 
     A monotonic nonlinearity like 1/(1-y) always produces H2 > H3 > H4...
     If a higher harmonic is stronger than a lower one, it indicates
     instrument-specific resonance, sympathetic coupling, or noise.
 
-    Returns set of harmonic indices (0-based, in H2-H8 space) that are anomalous.
+    real_dB is an (N, 8) H1-H8 dB matrix with NaN for masked harmonics.
+    Returns an (N, 7) bool mask in H2-H8 target space (0 = H2, 1 = H3, ...)
+    marking the higher harmonic of each H_{n+1} > H_n pair. Column 0 (H2)
+    is never flagged; NaN comparisons are False.
     """
-    anomalous = set()
-    for h in range(1, min(len(real_dB) - 1, 7)):
-        h_idx = h + 1  # h_idx in the full H1-H8 array
-        prev_idx = h    # previous harmonic in full array
-        if (real_dB[h_idx] is not None and real_dB[prev_idx] is not None
-                and real_dB[h_idx] > real_dB[prev_idx]):
-            # H_{n+1} stronger than H_n — anomalous (mark the higher harmonic)
-            anomalous.add(h)  # index in H2-H8 target space (0 = H2, 1 = H3, ...)
+    anomalous = np.zeros((len(real_dB), N_HARMONICS - 1), dtype=bool)
+    anomalous[:, 1:] = real_dB[:, 2:] > real_dB[:, 1:-1]
     return anomalous
 
 
-def compute_note_residual(real_feat, model_feat, snr_db=None):
-    """Compute v2 residual vector for one note observation.
+def _snr_cache_path(cache_dir, source_file, notes):
+    """Cache file for one recording's SNR matrix.
 
-    Returns (targets_11, mask_11) where targets has NaN for invalid entries.
+    Keyed on the recording's identity (path, size, mtime), the SNR settings
+    and the (f0, onset) of every note measured, so any change misses.
     """
-    targets = np.full(N_TARGETS, np.nan)
-    mask = np.zeros(N_TARGETS, dtype=bool)
-
-    # Use early_sustain window as primary (more stable than sustain for short notes)
-    real_win = real_feat["windows"].get("early_sustain")
-    model_win = model_feat["windows"].get("early_sustain")
-    if real_win is None or model_win is None:
-        real_win = real_feat["windows"].get("sustain")
-        model_win = model_feat["windows"].get("sustain")
-    if real_win is None or model_win is None:
-        return targets, mask
+    st = os.stat(source_file)
+    key = repr((SNR_CACHE_VERSION, os.path.abspath(source_file), st.st_size, st.st_mtime_ns,
+                SNR_N_HARMONICS, SNR_WINDOW_START_S, SNR_WINDOW_END_S,
+                [(f0, onset_s) for _, f0, onset_s in notes]))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
 
-    real_dB = real_win["amps_dB_rel_H1"]
-    model_dB = model_win["amps_dB_rel_H1"]
-    real_freqs = real_win["freqs_hz"]
-    model_freqs = model_win["freqs_hz"]
 
-    # Detect anomalous harmonic patterns in the recording
-    anomalous = detect_anomalous_harmonics(real_dB)
+def _snr_for_file(source_file, notes, fft_workers=None, cache_dir=None):
+    """Load one recording and measure SNR for every note that references it.
 
-    # v2: NO amplitude offsets — removed due to harmonic-vs-mode domain mismatch.
+    notes is a list of (note_id, f0, onset_s) tuples. Runs in a worker
+    process, so arguments and results are plain picklable values.
+    fft_workers threads the batched rfft (used when files run serially).
+    With cache_dir, results are reused from / saved to an .npy per file.
 
-    # Frequency offsets: H2-H6 in cents (5 values at indices 0-4)
-    for h in range(N_FREQ):  # H2 through H6
-        h_idx = h + 1  # index into harmonic arrays (1=H2, 2=H3, ...)
+    Returns (dict note_id -> snr_db array, warning message or None).
+    """
+    note_ids, f0s, onsets = zip(*notes)
+    cache_path = _snr_cache_path(cache_dir, source_file, notes) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        snr = np.load(cache_path)
+        return dict(zip(note_ids, snr)), None
+
+    try:
+        # Only decode the span covered by the measurement windows
+        offset_s = max(0.0, min(onsets) + SNR_WINDOW_START_S)
+        audio, sr = load_audio(source_file, max_duration_s=max(onsets) + SNR_WINDOW_END_S,
+                               offset_s=offset_s)
+    except Exception as e:
+        return {}, f"Could not load {source_file}: {e}"
+
+    snr = measure_interharmonic_snr_batch(audio, sr, f0s, onsets, n_harmonics=SNR_N_HARMONICS,
+                                          fft_workers=fft_workers, audio_offset=int(offset_s * sr))
+    if cache_path:
+        # Write-then-rename so a concurrent or interrupted run never sees a partial file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, snr, allow_pickle=False)
+        os.replace(tmp_path, cache_path)
+    return dict(zip(note_ids, snr)), None
+
+
+def load_audio_for_snr(features, workers=None, cache_dir=None):
+    """Load audio files and compute per-note SNR arrays.
 
-        if (real_freqs[h_idx] is None or model_freqs[h_idx] is None
-                or real_freqs[h_idx] <= 0 or model_freqs[h_idx] <= 0):
-            continue
+    features is a feature list or FeatureColumns. Notes are grouped by
+    source file so each recording is loaded once and measured in one batch.
+    Files are processed in parallel across up to `workers` processes
+    (default: os.cpu_count()); workers=1 runs serially. If cache_dir is
+    given, per-file SNR results are cached there and reused on reruns while
+    the recording and notes are unchanged.
 
-        # Mask H4+ (below OBM noise floor)
-        if h >= MAX_RELIABLE_HARMONIC:
+    Returns dict: note_id -> snr_db array
+    """
+    cols = as_columns(features)
+    by_file = {}
+    for note_id, source_file, f0 in zip(cols.ids, cols.source_file, cols.f0):
+        if not source_file or not os.path.exists(source_file):
             continue
+        # For OBM isolated notes, onset is at ~0 (start of file)
+        # For polyphonic, would need onset_s from scored_notes
+        onset_s = 0.0  # OBM files start at the note
+        by_file.setdefault(source_file, []).append((note_id, float(f0), onset_s))
 
-        # SNR-based masking (freq unreliable if harmonic is noise)
-        if snr_db is not None and h_idx < len(snr_db):
-            if np.isnan(snr_db[h_idx]) or snr_db[h_idx] < SNR_THRESHOLD_DB:
-                continue
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
 
-        # Anomalous pattern detection
-        if h in anomalous:
-            continue
+    workers = min(workers or os.cpu_count() or 1, len(by_file))
+    if workers > 1:
+        measure = functools.partial(_snr_for_file, cache_dir=cache_dir)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(measure, by_file.keys(), by_file.values()))
+    else:
+        # One process: spend the cores on the batched FFTs instead
+        results = [_snr_for_file(path, notes, fft_workers=-1, cache_dir=cache_dir)
+                   for path, notes in by_file.items()]
+
+    snr_cache = {}
+    for file_snr, warning in results:
+        if warning:
+            print(f"  WARNING: {warning}")
+        snr_cache.update(file_snr)
+    return snr_cache
+
+
+@dataclass
+class FeatureColumns:
+    """Struct-of-arrays view of a harmonic feature list (one row per observation).
+
+    Built once from the JSON list-of-dicts so residual computation works on
+    contiguous columns instead of nested dict lookups. Harmonic fields are
+    (N, N_HARMONICS) float32 arrays with NaN for missing windows and masked
+    (None) harmonics.
+    """
+    ids: np.ndarray          # (N,) object: note id (model key for model features)
+    midi: np.ndarray         # (N,) int
+    velocity: np.ndarray     # (N,) float32
+    tier: np.ndarray         # (N,) object: isolation tier name
+    f0: np.ndarray           # (N,) float: fundamental (Hz), NaN if absent
+    source_file: np.ndarray  # (N,) object: recording path ("" if absent)
+    has_early: np.ndarray    # (N,) bool: early_sustain window present
+    has_sus: np.ndarray      # (N,) bool: sustain window present
+    early_dB: np.ndarray
+    early_freqs: np.ndarray
+    early_lin: np.ndarray
+    sus_dB: np.ndarray
+    sus_freqs: np.ndarray
+    sus_lin: np.ndarray
+
+    def __len__(self):
+        return len(self.midi)
+
+    def take(self, rows):
+        """Row subset (fancy index or boolean mask) as a new FeatureColumns."""
+        return FeatureColumns(**{f.name: getattr(self, f.name)[rows] for f in fields(self)})
+
+
+def features_to_columns(features):
+    """Convert a feature list (harmonics.json / model_harmonics.json rows) to FeatureColumns."""
+    n = len(features)
+    windows = [feat["windows"] for feat in features]
+    missing = [None] * N_HARMONICS
+    window_cols = {}
+    for win_name in ("early_sustain", "sustain"):
+        wins = [w.get(win_name) for w in windows]
+        present = np.array([win is not None for win in wins], dtype=bool)
+        # One conversion per column; None (masked harmonic / missing window) -> NaN
+        stacked = {field: np.array([missing if win is None else win[field] for win in wins],
+                                   dtype=np.float32).reshape(n, N_HARMONICS)
+                   for field in ("amps_dB_rel_H1", "freqs_hz", "amps_linear")}
+        window_cols[win_name] = (present, stacked)
+
+    has_early, early = window_cols["early_sustain"]
+    has_sus, sus = window_cols["sustain"]
+    return FeatureColumns(
+        ids=np.array([feat.get("id", "") for feat in features], dtype=object),
+        midi=np.array([feat.get("midi_note", 0) for feat in features], dtype=np.int64),
+        velocity=np.array([feat.get("velocity_midi", 80) for feat in features], dtype=np.float32),
+        tier=np.array([feat.get("isolation_tier", "bronze") for feat in features], dtype=object),
+        f0=np.array([feat.get("f0", np.nan) for feat in features], dtype=float),
+        source_file=np.array([feat.get("source_file", "") for feat in features], dtype=object),
+        has_early=has_early,
+        has_sus=has_sus,
+        early_dB=early["amps_dB_rel_H1"],
+        early_freqs=early["freqs_hz"],
+        early_lin=early["amps_linear"],
+        sus_dB=sus["amps_dB_rel_H1"],
+        sus_freqs=sus["freqs_hz"],
+        sus_lin=sus["amps_linear"],
+    )
 
-        targets[h] = 1200.0 * math.log2(real_freqs[h_idx] / model_freqs[h_idx])
-        mask[h] = True
-
-    # Decay proxy: ratio of sustain/early_sustain amplitude for H2-H6 (5 values at indices 5-9)
-    real_early = real_feat["windows"].get("early_sustain")
-    real_sus = real_feat["windows"].get("sustain")
-    model_early = model_feat["windows"].get("early_sustain")
-    model_sus = model_feat["windows"].get("sustain")
-
-    if (real_early is not None and real_sus is not None
-            and model_early is not None and model_sus is not None):
-        for h in range(min(MAX_RELIABLE_HARMONIC, N_DECAY)):
-            h_idx = h + 1
-            re = real_early["amps_linear"][h_idx]
-            rs = real_sus["amps_linear"][h_idx]
-            me = model_early["amps_linear"][h_idx]
-            ms = model_sus["amps_linear"][h_idx]
-            if (re is not None and rs is not None and me is not None and ms is not None
-                    and re > 1e-12 and rs > 1e-12 and me > 1e-12 and ms > 1e-12):
-
-                if snr_db is not None and h_idx < len(snr_db):
-                    if np.isnan(snr_db[h_idx]) or snr_db[h_idx] < SNR_THRESHOLD_DB:
-                        continue
-
-                if h in anomalous:
-                    continue
-
-                real_ratio = rs / re    # <1 means decaying
-                model_ratio = ms / me
-                targets[N_FREQ + h] = real_ratio / model_ratio  # >1 means model decays too fast
-                mask[N_FREQ + h] = True
+
+def as_columns(features):
+    """Return features as FeatureColumns.
+
+    Accepts FeatureColumns (returned as is), a harmonics.json observation
+    list, or a model_harmonics.json dict keyed "{midi}_{vel_bucket}", whose
+    keys become the ids column.
+    """
+    if isinstance(features, FeatureColumns):
+        return features
+    if isinstance(features, dict):
+        cols = features_to_columns(list(features.values()))
+        cols.ids = np.array(list(features), dtype=object)
+        return cols
+    return features_to_columns(features)
+
+
+def load_feature_columns(path, cache_dir=None):
+    """Load harmonics.json / model_harmonics.json directly into FeatureColumns.
+
+    The parsed dicts are dropped once converted, so only the compact
+    columns stay resident for the rest of the run. If cache_dir is given,
+    the columns are also saved there as "<json name>.columns.npz", which
+    later runs load instead of re-parsing the JSON while its size and mtime
+    match.
+    """
+    st = os.stat(path)
+    stamp = np.array([FEATURE_CACHE_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+    use_cache = cache_dir is not None
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, os.path.basename(path) + ".columns.npz")
+    if use_cache and os.path.exists(cache_path):
+        with np.load(cache_path) as d:
+            if np.array_equal(d["stamp"], stamp):
+                # String columns are stored as fixed-width unicode (no pickle)
+                return FeatureColumns(**{
+                    f.name: d[f.name].astype(object) if d[f.name].dtype.kind == "U" else d[f.name]
+                    for f in fields(FeatureColumns)})
+
+    with open(path) as f:
+        cols = as_columns(json.load(f))
+    if use_cache:
+        arrays = {f.name: getattr(cols, f.name) for f in fields(cols)}
+        arrays = {name: arr.astype(str) if arr.dtype == object else arr
+                  for name, arr in arrays.items()}
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, stamp=stamp, **arrays)
+        os.replace(tmp_path, cache_path)
+    return cols
+
+
+def compute_residuals_batch(real, model, snr_list=None):
+    """Compute v2 residual vectors for N paired observations.
+
+    real and model are row-aligned FeatureColumns: real row i is compared
+    against model row i. snr_list is an optional length-N list of per-note
+    SNR arrays (or None where no SNR was measured, which disables SNR
+    masking for that note).
+
+    Returns (targets (N, 11) float32, mask (N, 11)) with NaN for invalid targets.
+    """
+    n = len(real)
+    targets = np.full((n, N_TARGETS), np.nan, dtype=np.float32)
+    mask = np.zeros((n, N_TARGETS), dtype=bool)
+    if n == 0:
+        return targets, mask
+
+    # early_sustain as primary window, sustain as fallback
+    use_early = (real.has_early & model.has_early)[:, None]
+    use_sus = (real.has_sus & model.has_sus)[:, None] & ~use_early
+
+    def select(early, sus):
+        return np.where(use_early, early, np.where(use_sus, sus, np.nan))
+
+    real_dB = select(real.early_dB, real.sus_dB)
+    model_dB = select(model.early_dB, model.sus_dB)
+    real_freqs = select(real.early_freqs, real.sus_freqs)
+    model_freqs = select(model.early_freqs, model.sus_freqs)
+
+    # SNR gate: unmeasured entries (no SNR for the note, or past the end of
+    # its SNR array) are +inf and pass; NaN compares False and fails.
+    snr_mat = np.full((n, N_HARMONICS), np.inf)
+    if snr_list is not None:
+        for i, snr_db in enumerate(snr_list):
+            if snr_db is not None:
+                k = min(len(snr_db), N_HARMONICS)
+                snr_mat[i, :k] = snr_db[:k]
+    snr_ok = snr_mat >= SNR_THRESHOLD_DB
+
+    # Anomalous harmonic patterns in the recording
+    anomalous = anomalous_harmonics(real_dB)
+
+    reliable = np.arange(max(N_FREQ, N_DECAY)) < MAX_RELIABLE_HARMONIC
+
+    # Frequency offsets: H2-H6 in cents
+    rf = real_freqs[:, 1:N_FREQ + 1]
+    mf = model_freqs[:, 1:N_FREQ + 1]
+    freq_ok = ((rf > 0) & (mf > 0) & reliable[:N_FREQ]
+               & snr_ok[:, 1:N_FREQ + 1] & ~anomalous[:, :N_FREQ])
+    # Ratio only where valid (1.0 elsewhere) so log2 never sees NaN/0/negatives
+    ratio = np.divide(rf, mf, out=np.ones_like(rf), where=freq_ok)
+    targets[:, :N_FREQ] = np.where(freq_ok, 1200.0 * np.log2(ratio), np.nan)
+    mask[:, :N_FREQ] = freq_ok
+
+    # Decay proxy: sustain/early_sustain amplitude ratio, real vs model
+    decay_rows = (real.has_early & real.has_sus & model.has_early & model.has_sus)[:, None]
+    re = real.early_lin[:, 1:N_DECAY + 1]
+    rs = real.sus_lin[:, 1:N_DECAY + 1]
+    me = model.early_lin[:, 1:N_DECAY + 1]
+    ms = model.sus_lin[:, 1:N_DECAY + 1]
+    decay_ok = (decay_rows & (re > 1e-12) & (rs > 1e-12) & (me > 1e-12) & (ms > 1e-12)
+                & reliable[:N_DECAY] & snr_ok[:, 1:N_DECAY + 1] & ~anomalous[:, :N_DECAY])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        decay_ratio = (rs / re) / (ms / me)
+    targets[:, N_FREQ:N_FREQ + N_DECAY] = np.where(decay_ok, decay_ratio, np.nan)
+    mask[:, N_FREQ:N_FREQ + N_DECAY] = decay_ok
 
     # ds_correction: derived from H2/H1 RATIO discrepancy
     # real_dB and model_dB are already relative to H1, so index 1 = H2/H1 ratio in dB.
@@ -233,71 +511,39 @@ def compute_note_residual(real_feat, model_feat, snr_db=None):
     # H2/H1 ≈ proportional to y_peak, so Δ(H2/H1_dB) ≈ 20*log10(ds2/ds1) ≈ 6*log2(ds2/ds1).
     # Therefore ds_correction = 2^(delta/6).
     # (v1 had 2^(-delta/6) — SIGN BUG that inverted the correction direction.)
-    h2_idx = 1  # H2 in the harmonic array
-    if (real_dB[h2_idx] is not None and model_dB[h2_idx] is not None):
-        # Check H2 SNR
-        h2_snr_ok = True
-        if snr_db is not None and h2_idx < len(snr_db):
-            if np.isnan(snr_db[h2_idx]) or snr_db[h2_idx] < SNR_THRESHOLD_DB:
-                h2_snr_ok = False
-        if 0 not in anomalous and h2_snr_ok:
-            delta_h2_ratio = real_dB[h2_idx] - model_dB[h2_idx]
-            targets[DS_IDX] = 2.0 ** (delta_h2_ratio / 6.0)
-            mask[DS_IDX] = True
+    delta_h2_ratio = real_dB[:, 1] - model_dB[:, 1]
+    ds_ok = ~np.isnan(delta_h2_ratio) & snr_ok[:, 1] & ~anomalous[:, 0]
+    targets[:, DS_IDX] = np.where(ds_ok, np.exp2(delta_h2_ratio * (1.0 / 6.0)), np.nan)
+    mask[:, DS_IDX] = ds_ok
 
     return targets, mask
 
 
-def load_audio_for_snr(features):
-    """Load audio files and compute per-note SNR arrays.
+def compute_note_residual(real_feat, model_feat, snr_db=None):
+    """Compute v2 residual vector for one note observation.
 
-    Returns dict: note_id -> snr_db array
+    Single-row convenience wrapper around compute_residuals_batch.
+    Returns (targets_11, mask_11) where targets has NaN for invalid entries.
     """
-    snr_cache = {}
-    audio_cache = {}
-
-    for feat in features:
-        note_id = feat.get("id", "")
-        source_file = feat.get("source_file", "")
-        if not source_file or not os.path.exists(source_file):
-            continue
-
-        # Load audio (cache by file)
-        if source_file not in audio_cache:
-            try:
-                audio, sr = load_audio(source_file)
-                audio_cache[source_file] = (audio, sr)
-            except Exception as e:
-                print(f"  WARNING: Could not load {source_file}: {e}")
-                continue
-
-        audio, sr = audio_cache[source_file]
-        f0 = feat["f0"]
-
-        # For OBM isolated notes, onset is at ~0 (start of file)
-        # For polyphonic, would need onset_s from scored_notes
-        onset_s = 0.0  # OBM files start at the note
-
-        snr = measure_interharmonic_snr(audio, sr, f0, onset_s,
-                                         n_harmonics=N_HARMONICS)
-        snr_cache[note_id] = snr
-
-    return snr_cache
+    targets, mask = compute_residuals_batch(
+        features_to_columns([real_feat]), features_to_columns([model_feat]), [snr_db])
+    return targets[0], mask[0]
 
 
 def assemble_dataset(real_features, model_features, snr_cache=None):
     """Assemble training dataset from real and model features.
 
+    Either argument may be FeatureColumns (see load_feature_columns) or the
+    raw JSON structure: an observation list for real features, a dict keyed
+    "{midi}_{vel_bucket}" for model features.
+
     Returns (inputs, targets, mask, weights) arrays.
     """
-    inputs_list = []
-    targets_list = []
-    mask_list = []
-    weights_list = []
-    note_ids = []
+    real = as_columns(real_features)
+    model = as_columns(model_features)
 
     filter_stats = {
-        'total_notes': 0,
+        'total_notes': len(real),
         'matched': 0,
         'h2_freq_valid': 0,
         'h3_freq_valid': 0,
@@ -305,62 +551,71 @@ def assemble_dataset(real_features, model_features, snr_cache=None):
         'ds_valid': 0,
     }
 
-    for real_feat in real_features:
-        midi = real_feat["midi_note"]
-        vel = real_feat.get("velocity_midi", 80)
-        vel_bucket = bucket_velocity(vel)
-        model_key = f"{midi}_{vel_bucket}"
+    # Match each real observation to its rendered model note. "{midi}_{vel_bucket}"
+    # keys are packed as midi * 128 + vel_bucket and matched by binary search.
+    model_keys = np.array([int(midi) * 128 + int(vel) for midi, vel in
+                           (key.split("_") for key in model.ids)], dtype=np.int64)
+    real_keys = real.midi * 128 + bucket_velocity_array(real.velocity)
+    order = np.argsort(model_keys)
+    sorted_keys = model_keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, real_keys), max(len(sorted_keys) - 1, 0))
+    matched = (sorted_keys[pos] == real_keys) if len(sorted_keys) else np.zeros(len(real), bool)
+    filter_stats['matched'] = int(matched.sum())
+    real = real.take(matched)
+    model = model.take(order[pos[matched]])
+
+    # Get SNR data for each matched note
+    snr_list = None
+    if snr_cache:
+        snr_list = [snr_cache.get(note_id) for note_id in real.ids]
+
+    targets, mask_arr = compute_residuals_batch(real, model, snr_list)
+
+    # Track filtering stats
+    filter_stats['h2_freq_valid'] = int(mask_arr[:, 0].sum())
+    filter_stats['h3_freq_valid'] = int(mask_arr[:, 1].sum())
+    filter_stats['h2_decay_valid'] = int(mask_arr[:, N_FREQ].sum())
+    filter_stats['ds_valid'] = int(mask_arr[:, DS_IDX].sum())
+
+    # Skip observations with no valid targets at all
+    keep = mask_arr.any(axis=1)
+    kept = real.take(keep)
+
+    # Normalize inputs to [0, 1]
+    inputs = np.empty((len(kept), 2), dtype=np.float32)
+    inputs[:, 0] = (kept.midi - 21) / (108 - 21)  # piano range
+    inputs[:, 1] = kept.velocity / 127.0
+
+    weights = np.array([TIER_WEIGHTS.get(tier, 0.3) for tier in kept.tier], dtype=np.float32)
+    note_ids = list(kept.ids)
+
+    targets = targets[keep]
+    mask_arr = mask_arr[keep]
+
+    # Replace NaN with 0 in targets (masked out anyway). Invalid entries are
+    # exactly the unmasked ones, so zero them in place.
+    targets[~mask_arr] = 0.0
 
-        filter_stats['total_notes'] += 1
-
-        if model_key not in model_features:
-            continue
-
-        filter_stats['matched'] += 1
-        model_feat = model_features[model_key]
-
-        # Get SNR data for this note
-        note_id = real_feat.get("id", "")
-        snr_db = snr_cache.get(note_id) if snr_cache else None
-
-        targets, mask_vec = compute_note_residual(real_feat, model_feat, snr_db)
-
-        # Track filtering stats
-        if mask_vec[0]:
-            filter_stats['h2_freq_valid'] += 1
-        if mask_vec[1]:
-            filter_stats['h3_freq_valid'] += 1
-        if mask_vec[N_FREQ]:
-            filter_stats['h2_decay_valid'] += 1
-        if mask_vec[DS_IDX]:
-            filter_stats['ds_valid'] += 1
-
-        # Skip if no valid targets at all
-        if not np.any(mask_vec):
-            continue
-
-        # Normalize inputs to [0, 1]
-        midi_norm = (midi - 21) / (108 - 21)  # piano range
-        vel_norm = vel / 127.0
-
-        tier = real_feat.get("isolation_tier", "bronze")
-        weight = TIER_WEIGHTS.get(tier, 0.3)
+    return inputs, targets, mask_arr, weights, note_ids, filter_stats
 
-        inputs_list.append([midi_norm, vel_norm])
-        targets_list.append(targets)
-        mask_list.append(mask_vec)
-        weights_list.append(weight)
-        note_ids.append(note_id)
 
-    inputs = np.array(inputs_list, dtype=np.float32)
-    targets = np.array(targets_list, dtype=np.float32)
-    mask_arr = np.array(mask_list, dtype=bool)
-    weights = np.array(weights_list, dtype=np.float32)
+def save_training_data(output_dir, inputs, targets, mask, weights):
+    """Write the dataset as output_dir/training_data/{inputs,targets,mask_packed,weights}.npy.
 
-    # Replace NaN with 0 in targets (masked out anyway)
-    targets = np.nan_to_num(targets, nan=0.0)
+    Separate uncompressed .npy files (unlike a zipped .npz) let consumers
+    memory-map them with np.load(path, mmap_mode='r'). The bool mask is
+    bit-packed along the target axis; unpack with
+    np.unpackbits(mask_packed, axis=1, count=targets.shape[1]).
 
-    return inputs, targets, mask_arr, weights, note_ids, filter_stats
+    Returns the training_data directory path.
+    """
+    data_dir = os.path.join(output_dir, "training_data")
+    os.makedirs(data_dir, exist_ok=True)
+    arrays = {"inputs": inputs, "targets": targets,
+              "mask_packed": np.packbits(mask, axis=1), "weights": weights}
+    for name, arr in arrays.items():
+        np.save(os.path.join(data_dir, f"{name}.npy"), arr, allow_pickle=False)
+    return data_dir
 
 
 def print_dataset_summary(inputs, targets, mask, weights, note_ids, filter_stats):
@@ -385,12 +640,9 @@ def print_dataset_summary(inputs, targets, mask, weights, note_ids, filter_stats
     print(f"  Velocity range: {vel_vals.min():.0f} - {vel_vals.max():.0f}")
 
     # Tier distribution
-    tier_counts = {}
-    for w in weights:
-        for tier, tw in TIER_WEIGHTS.items():
-            if abs(w - tw) < 0.01:
-                tier_counts[tier] = tier_counts.get(tier, 0) + 1
-                break
+    # Tier weights are far apart, so each weight matches at most one tier
+    tier_counts = {tier: int(np.count_nonzero(np.abs(weights - tw) < 0.01))
+                   for tier, tw in TIER_WEIGHTS.items()}
     for tier in ["gold", "silver", "bronze"]:
         print(f"  {tier}: {tier_counts.get(tier, 0)}")
 
@@ -433,21 +685,26 @@ def main():
     parser.add_argument("--model", default="model_harmonics.json",
                         help="Model harmonic features JSON")
     parser.add_argument("--output-dir", default="ml_data",
-                        help="Output directory for training_data.npz")
+                        help="Output directory for training_data/")
     parser.add_argument("--no-snr-filter", action="store_true",
                         help="Disable SNR-based filtering (not recommended)")
     parser.add_argument("--snr-threshold", type=float, default=SNR_THRESHOLD_DB,
                         help=f"SNR threshold in dB (default: {SNR_THRESHOLD_DB})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for SNR measurement (default: all cores)")
+    parser.add_argument("--snr-cache", default=None, metavar="DIR",
+                        help="Cache per-recording SNR results in DIR and reuse them on reruns")
+    parser.add_argument("--feature-cache", default=None, metavar="DIR",
+                        help="Cache the parsed feature JSON columns in DIR and reuse them on reruns")
     args = parser.parse_args()
 
     snr_threshold = args.snr_threshold
 
     base_dir = os.path.dirname(__file__)
 
-    with open(os.path.join(base_dir, args.real)) as f:
-        real_features = json.load(f)
-    with open(os.path.join(base_dir, args.model)) as f:
-        model_features = json.load(f)
+    feature_cache = os.path.join(base_dir, args.feature_cache) if args.feature_cache else None
+    real_features = load_feature_columns(os.path.join(base_dir, args.real), feature_cache)
+    model_features = load_feature_columns(os.path.join(base_dir, args.model), feature_cache)
 
     print(f"Real observations: {len(real_features)}")
     print(f"Model note/vel combos: {len(model_features)}")
@@ -456,14 +713,14 @@ def main():
     snr_cache = None
     if not args.no_snr_filter:
         print(f"\nComputing inter-harmonic SNR (threshold: {snr_threshold:.0f} dB)...")
-        snr_cache = load_audio_for_snr(real_features)
+        cache_dir = os.path.join(base_dir, args.snr_cache) if args.snr_cache else None
+        snr_cache = load_audio_for_snr(real_features, workers=args.workers, cache_dir=cache_dir)
         print(f"  SNR computed for {len(snr_cache)} notes")
 
         # Print per-note SNR summary
         print(f"\n  Per-harmonic SNR (dB):")
         print(f"  {'Note':>12} {'H1':>7} {'H2':>7} {'H3':>7} {'H4':>7}")
-        for feat in real_features:
-            nid = feat.get("id", "")
+        for nid in real_features.ids:
             snr = snr_cache.get(nid)
             if snr is not None:
                 vals = [f"{s:>7.1f}" if not np.isnan(s) else "    nan" for s in snr[:4]]
@@ -478,14 +735,8 @@ def main():
 
     # Save
     output_dir = os.path.join(base_dir, args.output_dir)
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, "training_data.npz")
-    np.savez(output_path,
-             inputs=inputs,
-             targets=targets,
-             mask=mask,
-             weights=weights)
-    print(f"\nSaved to {output_path}")
+    output_path = save_training_data(output_dir, inputs, targets, mask, weights)
+    print(f"\nSaved to {output_path}/")
     print(f"  inputs:  {inputs.shape}")
     print(f"  targets: {targets.shape}")
     print(f"  mask:    {mask.shape}")
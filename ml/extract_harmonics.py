@@ -13,14 +13,19 @@ Usage:
 """
 
 import argparse
+import functools
 import json
+import math
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
 from goertzel_utils import (
-    load_audio, extract_harmonics_fft, extract_harmonics_goertzel,
-    amps_to_dB, midi_to_freq
+    load_audio, extract_harmonics_goertzel, segment_spectra,
+    harmonics_from_spectrum, amps_to_dB, midi_to_freq
 )
 
 # Time windows relative to note onset (seconds)
@@ -35,15 +40,70 @@ DECAY_TIMES = [0.1, 0.3, 0.5, 0.8, 1.0, 1.5]
 
 N_HARMONICS = 8
 
+# Isolation tiers in increasing quality, for --min-tier filtering
+TIER_ORDER = {"gold": 3, "silver": 2, "bronze": 1, "reject": 0, "pending": -1}
+
 
 def rms(signal):
     """Root mean square of a signal."""
     if len(signal) == 0:
         return 1e-20
-    return max(np.sqrt(np.mean(signal ** 2)), 1e-20)
+    # dot fuses square-and-sum without a squared temporary
+    return max(np.sqrt(np.dot(signal, signal) / len(signal)), 1e-20)
+
+
+def json_floats(values, ndigits):
+    """Round an array to ndigits as a JSON-ready list, NaN -> None."""
+    return [None if math.isnan(v) else round(v, ndigits) for v in values.tolist()]
+
+
+def note_segment_bounds(note, sr, n_samples):
+    """Sample bounds of a note's analysis segments within its recording.
+
+    Returns ((onset_sample, offset_sample), window_bounds, decay_bounds), or
+    None if the note lies outside the audio. window_bounds maps each WINDOWS
+    name to an absolute (start, end) or None; decay_bounds has one (start,
+    end) or None per DECAY_TIMES point.
+    """
+    onset_s = note["onset_s"]
+    duration_s = note["offset_s"] - onset_s
+    onset_sample = int(onset_s * sr)
+    offset_sample = min(int(note["offset_s"] * sr), n_samples)
+
+    if onset_sample >= n_samples or onset_sample >= offset_sample:
+        return None
+    note_len = offset_sample - onset_sample
 
+    window_bounds = {}
+    for win_name, (win_start, win_end, min_dur) in WINDOWS.items():
+        window_bounds[win_name] = None
+        if duration_s < min_dur:
+            continue
 
-def extract_note_features(audio, sr, note, use_goertzel=False):
+        # Clip window to note duration
+        actual_end = min(win_end, duration_s)
+        if win_start >= actual_end:
+            continue
+
+        start_idx = min(int(win_start * sr), note_len)
+        end_idx = min(int(actual_end * sr), note_len)
+        if end_idx - start_idx < 128:  # too short for meaningful FFT
+            continue
+        window_bounds[win_name] = (onset_sample + start_idx, onset_sample + end_idx)
+
+    decay_bounds = []
+    for t in DECAY_TIMES:
+        start_idx = int(t * sr)
+        end_idx = min(int((t + 0.100) * sr), note_len)
+        if t >= duration_s - 0.05 or end_idx - start_idx < 64:
+            decay_bounds.append(None)
+        else:
+            decay_bounds.append((onset_sample + start_idx, onset_sample + end_idx))
+
+    return (onset_sample, offset_sample), window_bounds, decay_bounds
+
+
+def extract_note_features(audio, sr, note, use_goertzel=False, spectra=None):
     """Extract harmonic features for a single note.
 
     Args:
@@ -51,25 +111,30 @@ def extract_note_features(audio, sr, note, use_goertzel=False):
         sr: sample rate
         note: note dict with onset_s, offset_s, midi_note, harmonic_mask, etc.
         use_goertzel: if True, use precise Goertzel (slower); else FFT
+        spectra: FFT path only, segment_spectra() output covering this note's
+            segments (computed here if None)
 
     Returns:
         features dict or None if extraction fails
     """
+    bounds = note_segment_bounds(note, sr, len(audio))
+    if bounds is None:
+        return None
+    (onset_sample, offset_sample), window_bounds, decay_bounds = bounds
+
     onset_s = note["onset_s"]
-    offset_s = note["offset_s"]
-    duration_s = offset_s - onset_s
+    duration_s = note["offset_s"] - onset_s
     midi = note["midi_note"]
     f0 = note.get("measured_f0", midi_to_freq(midi))
     harmonic_mask = note.get("harmonic_mask", [True] * N_HARMONICS)
-
-    onset_sample = int(onset_s * sr)
-    offset_sample = min(int(offset_s * sr), len(audio))
-
-    if onset_sample >= len(audio) or onset_sample >= offset_sample:
-        return None
+    contaminated = ~np.asarray(harmonic_mask[:N_HARMONICS], dtype=bool)
 
     note_audio = audio[onset_sample:offset_sample]
 
+    if not use_goertzel and spectra is None:
+        # Equal-length segments (the decay points) share one stacked rfft
+        spectra = segment_spectra(audio, sr, filter(None, [*window_bounds.values(), *decay_bounds]))
+
     features = {
         "id": note["id"],
         "midi_note": midi,
@@ -78,72 +143,38 @@ def extract_note_features(audio, sr, note, use_goertzel=False):
         "windows": {},
     }
 
-    extract_fn = extract_harmonics_goertzel if use_goertzel else extract_harmonics_fft
-
     # Extract harmonics at each time window
-    for win_name, (win_start, win_end, min_dur) in WINDOWS.items():
-        if duration_s < min_dur:
-            features["windows"][win_name] = None
-            continue
-
-        # Clip window to note duration
-        actual_end = min(win_end, duration_s)
-        if win_start >= actual_end:
-            features["windows"][win_name] = None
-            continue
-
-        start_idx = int(win_start * sr)
-        end_idx = int(actual_end * sr)
-        segment = note_audio[start_idx:end_idx]
-
-        if len(segment) < 128:  # too short for meaningful FFT
+    for win_name, b in window_bounds.items():
+        if b is None:
             features["windows"][win_name] = None
             continue
 
         if use_goertzel:
-            amps = extract_fn(segment, sr, f0, N_HARMONICS)
+            amps = extract_harmonics_goertzel(audio[b[0]:b[1]], sr, f0, N_HARMONICS)
             freqs = np.array([f0 * (h + 1) for h in range(N_HARMONICS)])
         else:
-            amps, freqs = extract_fn(segment, sr, f0, N_HARMONICS)
+            amps, freqs = harmonics_from_spectrum(*spectra[b], sr, f0, N_HARMONICS)
 
         # Convert to dB relative to H1
         dB = amps_to_dB(amps)
 
-        # Apply harmonic mask: NaN for contaminated harmonics
-        amps_masked = np.array(amps, dtype=float)
-        dB_masked = np.array(dB, dtype=float)
-        freqs_masked = np.array(freqs, dtype=float)
-        for h in range(N_HARMONICS):
-            if not harmonic_mask[h]:
-                amps_masked[h] = float('nan')
-                dB_masked[h] = float('nan')
-                freqs_masked[h] = float('nan')
-
+        # Apply harmonic mask: NaN (stored as None) for contaminated harmonics
         features["windows"][win_name] = {
-            "amps_linear": [round(float(a), 8) if not np.isnan(a) else None
-                           for a in amps_masked],
-            "amps_dB_rel_H1": [round(float(d), 2) if not np.isnan(d) else None
-                               for d in dB_masked],
-            "freqs_hz": [round(float(f), 2) if not np.isnan(f) else None
-                        for f in freqs_masked],
+            "amps_linear": json_floats(np.where(contaminated, np.nan, amps), 8),
+            "amps_dB_rel_H1": json_floats(np.where(contaminated, np.nan, dB), 2),
+            "freqs_hz": json_floats(np.where(contaminated, np.nan, freqs), 2),
         }
 
     # Decay rate: H1 amplitude at multiple time points
     decay_amps = []
-    for t in DECAY_TIMES:
-        if t >= duration_s - 0.05:
+    for b in decay_bounds:
+        if b is None:
             decay_amps.append(None)
             continue
-        start_idx = int(t * sr)
-        end_idx = min(int((t + 0.100) * sr), len(note_audio))
-        if end_idx - start_idx < 64:
-            decay_amps.append(None)
-            continue
-        segment = note_audio[start_idx:end_idx]
         if use_goertzel:
-            h1_amp = extract_fn(segment, sr, f0, 1)[0]
+            h1_amp = extract_harmonics_goertzel(audio[b[0]:b[1]], sr, f0, 1)[0]
         else:
-            h1_amp = extract_fn(segment, sr, f0, 1)[0][0]
+            h1_amp = harmonics_from_spectrum(*spectra[b], sr, f0, 1)[0][0]
         decay_amps.append(round(float(h1_amp), 8))
 
     # Fit log-linear decay if we have enough points
@@ -153,9 +184,11 @@ def extract_note_features(audio, sr, note, use_goertzel=False):
     if len(valid_points) >= 3:
         times = np.array([p[0] for p in valid_points])
         log_amps = np.log10(np.array([p[1] for p in valid_points]))
-        # Linear regression: log10(amp) = slope * t + intercept
-        if np.std(times) > 0:
-            slope, intercept = np.polyfit(times, log_amps, 1)
+        # Linear regression: log10(amp) = slope * t + intercept, in closed
+        # form (polyfit's Vandermonde/lstsq setup dominates for 3-6 points)
+        dt = times - times.mean()
+        if dt @ dt > 0:
+            slope = dt @ (log_amps - log_amps.mean()) / (dt @ dt)
             decay_rate_dB_s = round(float(-20.0 * slope), 2)  # positive = decaying
 
     features["decay"] = {
@@ -201,54 +234,91 @@ def extract_note_features(audio, sr, note, use_goertzel=False):
     return features
 
 
-def extract_all_harmonics(notes, min_tier="bronze", use_goertzel_for_gold=True):
+def _features_for_file(source_file, file_notes, use_goertzel_for_gold=True, fft_workers=None):
+    """Load one recording and extract features for every note that references it.
+
+    Runs in a worker process, so arguments and results are plain picklable
+    values. fft_workers threads the batched rfft (used when files run
+    serially).
+
+    Returns (list of feature dicts, error message or None).
+    """
+    try:
+        audio, sr = load_audio(source_file)
+    except Exception as e:
+        return [], f"ERROR loading: {e}"
+
+    # FFT-path segments of every note in the file, batched by length
+    fft_notes = [n for n in file_notes
+                 if not (use_goertzel_for_gold and n.get("isolation_tier") == "gold")]
+    segments = []
+    for note in fft_notes:
+        bounds = note_segment_bounds(note, sr, len(audio))
+        if bounds is not None:
+            segments += [*bounds[1].values(), *bounds[2]]
+    spectra = segment_spectra(audio, sr, filter(None, segments), workers=fft_workers)
+
+    file_features = []
+    for note in file_notes:
+        is_gold = note.get("isolation_tier") == "gold"
+        use_goertzel = use_goertzel_for_gold and is_gold
+
+        features = extract_note_features(audio, sr, note, use_goertzel=use_goertzel,
+                                         spectra=spectra)
+        if features is not None:
+            features["isolation_tier"] = note.get("isolation_tier", "unknown")
+            features["isolation_score"] = note.get("isolation_score", 0.0)
+            features["velocity_midi"] = note.get("velocity_midi", 80)
+            features["source_file"] = note["source_file"]
+            file_features.append(features)
+    return file_features, None
+
+
+def extract_all_harmonics(notes, min_tier="bronze", use_goertzel_for_gold=True, workers=None):
     """Extract harmonic features for all notes at or above min_tier.
 
     Args:
         notes: list of scored note dicts
         min_tier: minimum isolation tier to process
         use_goertzel_for_gold: if True, use precise Goertzel for gold-tier notes
+        workers: source files processed in parallel (default: os.cpu_count());
+            1 runs serially
 
     Returns:
         list of feature dicts
     """
-    tier_order = {"gold": 3, "silver": 2, "bronze": 1, "reject": 0, "pending": -1}
-    min_tier_val = tier_order.get(min_tier, 1)
-
-    eligible = [n for n in notes
-                if tier_order.get(n.get("isolation_tier", "reject"), 0) >= min_tier_val]
-
-    print(f"Extracting harmonics for {len(eligible)} notes (>= {min_tier})...")
+    min_tier_val = TIER_ORDER.get(min_tier, 1)
 
-    # Group by source file to avoid reloading audio
+    # Filter by tier and group by source file (to avoid reloading audio) in one pass
     by_file = {}
-    for note in eligible:
-        sf = note["source_file"]
-        if sf not in by_file:
-            by_file[sf] = []
-        by_file[sf].append(note)
+    for note in notes:
+        if TIER_ORDER.get(note.get("isolation_tier", "reject"), 0) >= min_tier_val:
+            by_file.setdefault(note["source_file"], []).append(note)
+    by_file = dict(sorted(by_file.items()))
+    n_eligible = sum(len(file_notes) for file_notes in by_file.values())
+
+    print(f"Extracting harmonics for {n_eligible} notes (>= {min_tier})...")
+
+    extract = functools.partial(_features_for_file, use_goertzel_for_gold=use_goertzel_for_gold)
+    workers = min(workers or os.cpu_count() or 1, len(by_file))
+    if workers > 1:
+        # spawn, not fork: pipeline.py keeps its stage 4 render pool threads
+        # alive during this stage, and forking a threaded process can deadlock
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(extract, by_file.keys(), by_file.values()))
+    else:
+        # One process: spend the cores on the batched FFTs instead
+        results = [extract(path, file_notes, fft_workers=-1)
+                   for path, file_notes in by_file.items()]
 
     all_features = []
-    for source_file, file_notes in sorted(by_file.items()):
+    for (source_file, file_notes), (file_features, error) in zip(by_file.items(), results):
         print(f"  Loading {os.path.basename(source_file)}...")
-        try:
-            audio, sr = load_audio(source_file)
-        except Exception as e:
-            print(f"    ERROR loading: {e}")
+        if error:
+            print(f"    {error}")
             continue
-
-        for note in file_notes:
-            is_gold = note.get("isolation_tier") == "gold"
-            use_goertzel = use_goertzel_for_gold and is_gold
-
-            features = extract_note_features(audio, sr, note, use_goertzel=use_goertzel)
-            if features is not None:
-                features["isolation_tier"] = note.get("isolation_tier", "unknown")
-                features["isolation_score"] = note.get("isolation_score", 0.0)
-                features["velocity_midi"] = note.get("velocity_midi", 80)
-                features["source_file"] = note["source_file"]
-                all_features.append(features)
-
+        all_features.extend(file_features)
         print(f"    Extracted {sum(1 for n in file_notes if True)} notes")
 
     return all_features
@@ -292,6 +362,8 @@ def main():
                         help="Minimum isolation tier to extract")
     parser.add_argument("--goertzel-all", action="store_true",
                         help="Use Goertzel for all notes (slow but precise)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for per-file extraction (default: all cores)")
     args = parser.parse_args()
 
     input_path = os.path.join(os.path.dirname(__file__), args.input)
@@ -301,13 +373,14 @@ def main():
     features = extract_all_harmonics(
         notes,
         min_tier=args.min_tier,
-        use_goertzel_for_gold=not args.goertzel_all)
+        use_goertzel_for_gold=not args.goertzel_all,
+        workers=args.workers)
 
     print_summary(features)
 
     output_path = os.path.join(os.path.dirname(__file__), args.output)
     with open(output_path, 'w') as f:
-        json.dump(features, f, indent=2)
+        json.dump(features, f, separators=(",", ":"))
     print(f"\nSaved to {output_path}")
 
 
@@ -10,12 +10,15 @@ Usage:
 """
 
 import argparse
+import functools
 import json
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
-from goertzel_utils import load_audio, extract_harmonics_fft, midi_to_freq
+from goertzel_utils import load_audio, magnitude_spectrum, harmonics_from_spectrum, midi_to_freq
 
 
 # OBM file mapping: filename -> (MIDI note, actual frequency Hz)
@@ -39,29 +42,32 @@ OBM_FILES = {
     "87997__oldbassman__d7.wav":  (98, 2363.1),
 }
 
+# End of the early sustain window probed by octave correction (s after onset)
+OCTAVE_WINDOW_END_S = 0.200
+
 
 def detect_obm_onset(data, sr, threshold_frac=0.10):
     """Find onset in OBM isolated note by threshold detection."""
-    peak = np.max(np.abs(data))
+    abs_data = np.abs(data)
+    peak = np.max(abs_data)
     if peak < 1e-10:
         return 0.0
-    threshold = threshold_frac * peak
-    for i in range(len(data)):
-        if abs(data[i]) > threshold:
-            return i / sr
-    return 0.0
+    above = abs_data > threshold_frac * peak
+    i = int(np.argmax(above))  # first True, or 0 if none
+    return i / sr if above[i] else 0.0
 
 
 def detect_obm_offset(data, sr, onset_s, threshold_frac=0.01):
     """Find offset: last sample above 1% of peak, searching backwards."""
-    peak = np.max(np.abs(data))
+    abs_data = np.abs(data)
+    peak = np.max(abs_data)
     if peak < 1e-10:
         return len(data) / sr
-    threshold = threshold_frac * peak
-    for i in range(len(data) - 1, 0, -1):
-        if abs(data[i]) > threshold:
-            return i / sr
-    return len(data) / sr
+    # Sample 0 is never reported as the offset
+    above = abs_data[1:] > threshold_frac * peak
+    if not above.any():
+        return len(data) / sr
+    return (len(above) - int(np.argmax(above[::-1]))) / sr
 
 
 def extract_obm_notes():
@@ -110,7 +116,7 @@ def correct_octave_errors(notes, audio, sr):
 
         # Early sustain window: 50-200ms after onset
         start = onset_sample + int(0.050 * sr)
-        end = min(onset_sample + int(0.200 * sr), len(audio))
+        end = min(onset_sample + int(OCTAVE_WINDOW_END_S * sr), len(audio))
         if end - start < 128:
             # Fall back to 0-150ms
             start = onset_sample
@@ -119,26 +125,27 @@ def correct_octave_errors(notes, audio, sr):
                 to_remove.append(i)
                 continue
 
-        segment = audio[start:end]
+        # One spectrum serves all four probes (f0, noise, octave up/down)
+        spectrum, freqs_axis = magnitude_spectrum(audio[start:end], sr)
 
         # Measure energy at f0
-        amp_f0 = extract_harmonics_fft(segment, sr, f0, 1)[0][0]
+        amp_f0 = harmonics_from_spectrum(spectrum, freqs_axis, sr, f0, 1)[0][0]
 
         # Noise floor: energy between harmonics (f0 * 1.37)
         f_noise = f0 * 1.37
         amp_noise = 1e-20
         if f_noise < sr / 2 - 200:
-            amp_noise = max(extract_harmonics_fft(segment, sr, f_noise, 1)[0][0], 1e-20)
+            amp_noise = max(harmonics_from_spectrum(spectrum, freqs_axis, sr, f_noise, 1)[0][0], 1e-20)
 
         # Check octave above (2*f0)
         amp_up = 0.0
         if f0 * 2 < sr / 2 - 200:
-            amp_up = extract_harmonics_fft(segment, sr, f0 * 2, 1)[0][0]
+            amp_up = harmonics_from_spectrum(spectrum, freqs_axis, sr, f0 * 2, 1)[0][0]
 
         # Check octave below (f0/2)
         amp_down = 0.0
         if f0 / 2 > 30:
-            amp_down = extract_harmonics_fft(segment, sr, f0 / 2, 1)[0][0]
+            amp_down = harmonics_from_spectrum(spectrum, freqs_axis, sr, f0 / 2, 1)[0][0]
 
         # Decision logic
         best_amp = amp_f0
@@ -211,35 +218,76 @@ def extract_polyphonic_notes(audio_path, onset_threshold=0.5, frame_threshold=0.
     raw_count = len(notes)
     print(f"    -> {raw_count} notes detected, verifying pitches...")
 
-    # Load audio for octave correction
-    audio, sr = load_audio(audio_path)
-    corrected, removed = correct_octave_errors(notes, audio, sr)
+    # Load audio for octave correction. basic-pitch decodes the file itself
+    # (path-only API, own sample rate), so only decode what the probes read:
+    # up to the end of the last note's early sustain window.
+    corrected = removed = 0
+    if notes:
+        last_onset_s = max(n["onset_s"] for n in notes)
+        audio, sr = load_audio(audio_path, max_duration_s=last_onset_s + OCTAVE_WINDOW_END_S)
+        corrected, removed = correct_octave_errors(notes, audio, sr)
     print(f"    -> {corrected} octave-corrected, {removed} weak-removed, "
           f"{len(notes)} kept")
 
     return notes
 
 
+def _polyphonic_notes_or_error(audio_path, onset_threshold=0.5, frame_threshold=0.3):
+    """extract_polyphonic_notes(), returning (notes, error message or None)."""
+    try:
+        return extract_polyphonic_notes(audio_path, onset_threshold, frame_threshold), None
+    except Exception as e:
+        return [], str(e)
+
+
+def extract_all_polyphonic_notes(recordings, onset_threshold=0.5, frame_threshold=0.3,
+                                 workers=None):
+    """extract_polyphonic_notes() for every recording, skipping failures.
+
+    Recordings are independent, so they are spread over `workers` processes
+    (default: os.cpu_count()); workers=1 runs serially.
+
+    Returns the notes of all recordings, in recording order.
+    """
+    extract = functools.partial(_polyphonic_notes_or_error, onset_threshold=onset_threshold,
+                                frame_threshold=frame_threshold)
+    workers = min(workers or os.cpu_count() or 1, len(recordings))
+    if workers > 1:
+        # spawn, not fork: basic-pitch's inference runtime is not fork-safe
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(extract, recordings))
+    else:
+        results = [extract(rec_path) for rec_path in recordings]
+
+    all_notes = []
+    for rec_path, (notes, error) in zip(recordings, results):
+        if error is not None:
+            print(f"  ERROR processing {rec_path}: {error}")
+            continue
+        all_notes.extend(notes)
+    return all_notes
+
+
 def find_recordings(input_dir):
     """Find all WAV/FLAC recordings in input_dir (excluding OBM isolated notes)."""
     recordings = []
     obm_subdir = os.path.basename(os.path.normpath(OBM_DIR))
-    for entry in sorted(os.listdir(input_dir)):
-        path = os.path.join(input_dir, entry)
-        if os.path.isdir(path):
+    # scandir entries carry their file type, so no extra stat per entry
+    for entry in sorted(os.scandir(input_dir), key=lambda e: e.name):
+        if entry.is_dir():
             # Skip OBM directory -- handled separately
-            if obm_subdir in entry:
+            if obm_subdir in entry.name:
                 continue
             # Recurse into subdirectories
-            for sub in sorted(os.listdir(path)):
-                subpath = os.path.join(path, sub)
-                if sub.lower().endswith(('.wav', '.flac')) and os.path.isfile(subpath):
-                    recordings.append(subpath)
-        elif entry.lower().endswith(('.wav', '.flac')) and os.path.isfile(path):
+            for sub in sorted(os.scandir(entry.path), key=lambda e: e.name):
+                if sub.name.lower().endswith(('.wav', '.flac')) and sub.is_file():
+                    recordings.append(sub.path)
+        elif entry.name.lower().endswith(('.wav', '.flac')) and entry.is_file():
             # Skip model renders and test outputs
-            if any(skip in entry.lower() for skip in ['vurli', 'model', 'output', 'test']):
+            if any(skip in entry.name.lower() for skip in ['vurli', 'model', 'output', 'test']):
                 continue
-            recordings.append(path)
+            recordings.append(entry.path)
     return recordings
 
 
@@ -255,6 +303,8 @@ def main():
                         help="basic-pitch onset threshold")
     parser.add_argument("--frame-threshold", type=float, default=0.3,
                         help="basic-pitch frame threshold")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for per-recording note extraction (default: all cores)")
     args = parser.parse_args()
 
     all_notes = []
@@ -272,15 +322,11 @@ def main():
         for r in recordings:
             print(f"  {os.path.basename(r)}")
 
-        for rec_path in recordings:
-            try:
-                notes = extract_polyphonic_notes(
-                    rec_path,
-                    onset_threshold=args.onset_threshold,
-                    frame_threshold=args.frame_threshold)
-                all_notes.extend(notes)
-            except Exception as e:
-                print(f"  ERROR processing {rec_path}: {e}")
+        all_notes.extend(extract_all_polyphonic_notes(
+            recordings,
+            onset_threshold=args.onset_threshold,
+            frame_threshold=args.frame_threshold,
+            workers=args.workers))
 
     # Summary
     print(f"\nTotal: {len(all_notes)} notes")
@@ -298,7 +344,7 @@ def main():
     # Save
     output_path = os.path.join(os.path.dirname(__file__), args.output)
     with open(output_path, 'w') as f:
-        json.dump(all_notes, f, indent=2)
+        json.dump(all_notes, f, separators=(",", ":"))
     print(f"\nSaved to {output_path}")
 
 
@@ -13,9 +13,11 @@ This version:
 4. Checks the ACTUAL effective y_peak driving the nonlinearity
 """
 
+import functools
 import numpy as np
 import json
 import os
+from scipy.signal import lfilter
 
 HPF_FC = 2312.0
 SENSITIVITY = 1.8375
@@ -40,11 +42,14 @@ def reed_blank_dims(midi):
     else: t = 0.031
     return w * 25.4, t * 25.4
 
+# Pure functions of the MIDI note (a small integer domain): memoize them
+@functools.lru_cache(maxsize=128)
 def reed_compliance(midi):
     l = reed_length_mm(midi)
     w, t = reed_blank_dims(midi)
     return l**3 / (w * t**3)
 
+@functools.lru_cache(maxsize=128)
 def pickup_ds(midi):
     c = reed_compliance(midi)
     c_ref = reed_compliance(60)
@@ -55,7 +60,43 @@ def velocity_exponent(midi):
     t = np.exp(-0.5 * ((m - 62.0) / 15.0)**2)
     return 0.75 + t * 0.65
 
-def compute_harmonics(f0, ds, vel_midi=80, alpha=1.0, sr=44100, dur=0.5, n_harm=8):
+@functools.lru_cache(maxsize=32)
+def _dft_basis(freqs, m, sr):
+    """cos/sin rows of the DFT of an m-sample signal at freqs (Hz).
+
+    Cached: the sweeps below re-evaluate the same notes' harmonics for
+    every alpha / k / blend value.
+    """
+    phase = np.outer(2 * np.pi * np.asarray(freqs), np.arange(m)) / sr
+    return np.cos(phase), np.sin(phase)
+
+def dft_amps(sig, freqs, sr):
+    """Amplitude 2|X(f)| of sig at each frequency (exact DFT, not bin-snapped).
+
+    sig may be 2-D (signals along the last axis); returns (..., len(freqs)).
+    """
+    m = sig.shape[-1]
+    cos_b, sin_b = _dft_basis(tuple(freqs), m, sr)
+    re = sig @ cos_b.T / m
+    im = -(sig @ sin_b.T) / m
+    return 2 * np.sqrt(re**2 + im**2)
+
+def hpf_1pole(v, sr):
+    """1-pole HPF at HPF_FC (bilinear): y[i] = b0*(x[i] - x[i-1]) + a1*y[i-1]."""
+    w_d = np.tan(np.pi * HPF_FC / sr)
+    a1 = (1 - w_d) / (1 + w_d)
+    b0 = 1.0 / (1 + w_d)
+    return lfilter([b0, -b0], [1.0, -a1], v)
+
+def compute_harmonics(f0, ds, vel_midi=80, alpha=1.0, sr=44100, dur=0.5, n_harm=8,
+                      nonlinearity=None):
+    """Model H1..Hn amplitudes and y_peak for one note.
+
+    nonlinearity(y) replaces the default y/(1-y)^alpha. alpha may be an
+    array, or nonlinearity may return one row per variant: the reed signal
+    is built once and amps comes back as an (n_variants, n_harm) array
+    instead of a list.
+    """
     midi_approx = 69 + 12 * np.log2(f0 / 440.0)
     vel = vel_midi / 127.0
     vel_scale = vel ** velocity_exponent(midi_approx)
@@ -63,43 +104,42 @@ def compute_harmonics(f0, ds, vel_midi=80, alpha=1.0, sr=44100, dur=0.5, n_harm=
     t = np.arange(n) / sr
     reed = vel_scale * np.sin(2 * np.pi * f0 * t)
     y = np.clip(reed * ds, -0.90, 0.90)
-    nonlinear = y / np.power(1.0 - y, alpha)
+    if nonlinearity is None:
+        nonlinear = y / np.power(1.0 - y, np.asarray(alpha, dtype=float)[..., None])
+    else:
+        nonlinear = nonlinearity(y)
     v = nonlinear * SENSITIVITY
 
-    # 1-pole HPF (bilinear)
-    w_d = np.tan(np.pi * HPF_FC / sr)
-    a1 = (1 - w_d) / (1 + w_d)
-    b0 = 1.0 / (1 + w_d)
-    output = np.zeros(n)
-    xp, yp = 0.0, 0.0
-    for i in range(n):
-        output[i] = b0 * v[i] - b0 * xp + a1 * yp
-        xp = v[i]; yp = output[i]
+    output = hpf_1pole(v, sr)
 
     # Also track y_peak
     y_peak = np.max(np.abs(y[n//4:]))
 
     start = n // 2
-    sig = output[start:]
-    m = len(sig)
-    amps = []
-    for h in range(1, n_harm + 1):
-        freq = h * f0
-        k = np.arange(m)
-        phase = 2 * np.pi * freq * k / sr
-        re = np.sum(sig * np.cos(phase)) / m
-        im = -np.sum(sig * np.sin(phase)) / m
-        amps.append(2 * np.sqrt(re**2 + im**2))
+    sig = output[..., start:]
+    amps = dft_amps(sig, [h * f0 for h in range(1, n_harm + 1)], sr)
+
+    return (list(amps) if amps.ndim == 1 else amps), y_peak
+
+
+def harmonic_db_errors(amps, obm_h2, obm_h3):
+    """OBM minus model H2 and H3 (dB rel H1) for one sweep variant.
 
-    return amps, y_peak
+    amps is (n_notes, >=3) model amplitudes, obm_h2/obm_h3 the matching
+    OBM dB. Notes with no H1 are skipped; a zero H2/H3 counts as -120 dB.
+    """
+    ok = amps[:, 0] > 0
+    amps = amps[ok]
+    with np.errstate(divide='ignore'):
+        db = np.where(amps[:, 1:3] > 0, 20*np.log10(amps[:, 1:3] / amps[:, :1]), -120)
+    return obm_h2[ok] - db[:, 0], obm_h3[ok] - db[:, 1]
 
 
 def measure_interharmonic_floor(audio_file, f0, n_harmonics=8, window='early_sustain'):
     """Measure broadband noise floor between harmonics in OBM recording."""
     import soundfile as sf
-    audio, sr = sf.read(audio_file)
-    if audio.ndim > 1:
-        audio = audio[:, 0]
+    info = sf.info(audio_file)
+    sr = info.samplerate
 
     # Window selection
     if window == 'early_sustain':
@@ -109,33 +149,21 @@ def measure_interharmonic_floor(audio_file, f0, n_harmonics=8, window='early_sus
         start = int(0.2 * sr)
         end = int(0.8 * sr)
 
-    if end > len(audio):
-        end = len(audio)
+    if end > info.frames:
+        end = info.frames
     if start >= end:
         return [float('nan')] * n_harmonics, [float('nan')] * n_harmonics
 
-    sig = audio[start:end]
-    n = len(sig)
-
-    # Harmonic amplitudes
-    h_amps = []
-    for h in range(1, n_harmonics + 1):
-        freq = h * f0
-        k = np.arange(n)
-        phase = 2 * np.pi * freq * k / sr
-        re = np.sum(sig * np.cos(phase)) / n
-        im = -np.sum(sig * np.sin(phase)) / n
-        h_amps.append(2 * np.sqrt(re**2 + im**2))
-
-    # Inter-harmonic noise (at h+0.5 × f0)
-    noise_amps = []
-    for h in range(1, n_harmonics + 1):
-        freq = (h + 0.5) * f0
-        k = np.arange(n)
-        phase = 2 * np.pi * freq * k / sr
-        re = np.sum(sig * np.cos(phase)) / n
-        im = -np.sum(sig * np.sin(phase)) / n
-        noise_amps.append(2 * np.sqrt(re**2 + im**2))
+    # Decode only the analysis window, not the whole recording
+    sig, _ = sf.read(audio_file, start=start, stop=end, always_2d=True)
+    sig = sig[:, 0]
+
+    # Harmonic amplitudes, and inter-harmonic noise (at h+0.5 × f0)
+    freqs = [h * f0 for h in range(1, n_harmonics + 1)]
+    freqs += [(h + 0.5) * f0 for h in range(1, n_harmonics + 1)]
+    amps = dft_amps(sig, freqs, sr)
+    h_amps = list(amps[:n_harmonics])
+    noise_amps = list(amps[n_harmonics:])
 
     # SNR for each harmonic
     snr = []
@@ -250,23 +278,21 @@ def main():
     print(f"\n{'='*95}")
     print("ALPHA SWEEP — Reliable notes only")
     print(f"{'='*95}")
+    # Per-note inputs of Steps 4-6, gathered once as arrays
+    f0_arr = np.array([midi_to_freq(m) for m in reliable_midis])
+    ds_arr = np.array([pickup_ds(m) for m in reliable_midis])
+    obm_h2 = np.array([obm[m]['db'][1] for m in reliable_midis])
+    obm_h3 = np.array([obm[m]['db'][2] for m in reliable_midis])
+
     alphas = np.arange(1.0, 2.51, 0.1)
+    # Each note's harmonics for the whole sweep in one batched evaluation
+    sweep_amps = np.stack([compute_harmonics(f0, ds, alpha=alphas)[0]
+                           for f0, ds in zip(f0_arr, ds_arr)])
     best = (1.0, 999, 999)
-    for alpha in alphas:
-        h2e, h3e = [], []
-        for midi in reliable_midis:
-            o = obm[midi]
-            f0 = midi_to_freq(midi)
-            ds = pickup_ds(midi)
-            amps, _ = compute_harmonics(f0, ds, alpha=alpha)
-            h1 = amps[0]
-            if h1 > 0:
-                h2_db = 20*np.log10(amps[1]/h1) if amps[1] > 0 else -120
-                h3_db = 20*np.log10(amps[2]/h1) if amps[2] > 0 else -120
-                h2e.append(o['db'][1] - h2_db)
-                h3e.append(o['db'][2] - h3_db)
-        h3_rms = np.sqrt(np.mean(np.array(h3e)**2))
-        combined = np.sqrt(np.mean(np.array(h2e)**2 + np.array(h3e)**2))
+    for i, alpha in enumerate(alphas):
+        h2e, h3e = harmonic_db_errors(sweep_amps[:, i], obm_h2, obm_h3)
+        h3_rms = np.sqrt(np.mean(h3e**2))
+        combined = np.sqrt(np.mean(h2e**2 + h3e**2))
         if combined < best[2]:
             best = (alpha, h3_rms, combined)
         print(f"  alpha={alpha:.1f}  H2: {np.mean(h2e):+6.1f}±{np.std(h2e):.1f}  "
@@ -281,54 +307,18 @@ def main():
     print("This adds an asymmetric enhancement that boosts H3 relative to H2")
     print(f"{'='*95}")
 
-    for k in [0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0]:
-        h2e, h3e = [], []
-        for midi in reliable_midis:
-            o = obm[midi]
-            f0 = midi_to_freq(midi)
-            ds = pickup_ds(midi)
-
-            # Custom nonlinearity: y/(1-y) * (1 + k*y)
-            vel = 80/127.0
-            vel_scale = vel ** velocity_exponent(midi)
-            sr = 44100; dur = 0.5; n = int(sr*dur)
-            t_arr = np.arange(n) / sr
-            reed = vel_scale * np.sin(2*np.pi*f0*t_arr)
-            y = np.clip(reed * ds, -0.90, 0.90)
-            # Modified nonlinearity
-            nl = y / (1.0 - y) * (1.0 + k * y)
-            v = nl * SENSITIVITY
-
-            # HPF
-            w_d = np.tan(np.pi * HPF_FC / sr)
-            a1c = (1 - w_d) / (1 + w_d)
-            b0c = 1.0 / (1 + w_d)
-            out = np.zeros(n)
-            xp, yp = 0.0, 0.0
-            for i in range(n):
-                out[i] = b0c*v[i] - b0c*xp + a1c*yp
-                xp = v[i]; yp = out[i]
-
-            start = n//2; sig = out[start:]; m = len(sig)
-            amps = []
-            for h in range(1, 4):
-                freq = h * f0; kk = np.arange(m)
-                phase = 2*np.pi*freq*kk/sr
-                re = np.sum(sig*np.cos(phase))/m
-                im = -np.sum(sig*np.sin(phase))/m
-                amps.append(2*np.sqrt(re**2+im**2))
-
-            h1 = amps[0]
-            if h1 > 0:
-                h2_db = 20*np.log10(amps[1]/h1) if amps[1] > 0 else -120
-                h3_db = 20*np.log10(amps[2]/h1) if amps[2] > 0 else -120
-                h2e.append(o['db'][1] - h2_db)
-                h3e.append(o['db'][2] - h3_db)
-
+    ks = np.array([0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0])
+    # Custom nonlinearity y/(1-y) * (1 + k*y), every k in one evaluation per note
+    sweep_amps = np.stack([compute_harmonics(
+                               f0, ds, n_harm=3,
+                               nonlinearity=lambda y: y / (1.0 - y) * (1.0 + ks[:, None] * y))[0]
+                           for f0, ds in zip(f0_arr, ds_arr)])
+    for i, k in enumerate(ks):
+        h2e, h3e = harmonic_db_errors(sweep_amps[:, i], obm_h2, obm_h3)
         h2m, h3m = np.mean(h2e), np.mean(h3e)
         h2s, h3s = np.std(h2e), np.std(h3e)
         print(f"  k={k:.1f}  H2: {h2m:+6.1f}±{h2s:.1f}  H3: {h3m:+6.1f}±{h3s:.1f}  "
-              f"combined={np.sqrt(np.mean(np.array(h2e)**2+np.array(h3e)**2)):.1f}")
+              f"combined={np.sqrt(np.mean(h2e**2+h3e**2)):.1f}")
 
     # ── Step 6: What about y/(1-y²) — symmetric approach/retreat ───────
     print(f"\n{'='*95}")
@@ -336,54 +326,18 @@ def main():
     print("Models reed that moves BOTH toward and away from plate")
     print(f"{'='*95}")
 
-    for blend in [0.0, 0.2, 0.4, 0.6, 0.8, 1.0]:
-        h2e, h3e = [], []
-        for midi in reliable_midis:
-            o = obm[midi]
-            f0 = midi_to_freq(midi)
-            ds = pickup_ds(midi)
-
-            vel = 80/127.0
-            vel_scale = vel ** velocity_exponent(midi)
-            sr = 44100; dur = 0.5; n = int(sr*dur)
-            t_arr = np.arange(n) / sr
-            reed = vel_scale * np.sin(2*np.pi*f0*t_arr)
-            y = np.clip(reed * ds, -0.90, 0.90)
-
-            # Blended: (1-blend)*y/(1-y) + blend*y/(1-y^2)
-            nl_asym = y / (1.0 - y)
-            nl_sym = y / (1.0 - y**2)
-            nl = (1 - blend) * nl_asym + blend * nl_sym
-            v = nl * SENSITIVITY
-
-            w_d = np.tan(np.pi * HPF_FC / sr)
-            a1c = (1 - w_d) / (1 + w_d)
-            b0c = 1.0 / (1 + w_d)
-            out = np.zeros(n)
-            xp, yp = 0.0, 0.0
-            for i in range(n):
-                out[i] = b0c*v[i] - b0c*xp + a1c*yp
-                xp = v[i]; yp = out[i]
-
-            start = n//2; sig = out[start:]; m = len(sig)
-            amps = []
-            for h in range(1, 4):
-                freq = h * f0; kk = np.arange(m)
-                phase = 2*np.pi*freq*kk/sr
-                re = np.sum(sig*np.cos(phase))/m
-                im = -np.sum(sig*np.sin(phase))/m
-                amps.append(2*np.sqrt(re**2+im**2))
-
-            h1 = amps[0]
-            if h1 > 0:
-                h2_db = 20*np.log10(amps[1]/h1) if amps[1] > 0 else -120
-                h3_db = 20*np.log10(amps[2]/h1) if amps[2] > 0 else -120
-                h2e.append(o['db'][1] - h2_db)
-                h3e.append(o['db'][2] - h3_db)
-
+    blends = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1.0])
+    # Blended: (1-blend)*y/(1-y) + blend*y/(1-y^2), every blend in one evaluation
+    sweep_amps = np.stack([compute_harmonics(
+                               f0, ds, n_harm=3,
+                               nonlinearity=lambda y: ((1 - blends[:, None]) * (y / (1.0 - y))
+                                                       + blends[:, None] * (y / (1.0 - y**2))))[0]
+                           for f0, ds in zip(f0_arr, ds_arr)])
+    for i, blend in enumerate(blends):
+        h2e, h3e = harmonic_db_errors(sweep_amps[:, i], obm_h2, obm_h3)
         print(f"  blend={blend:.1f}  H2: {np.mean(h2e):+6.1f}±{np.std(h2e):.1f}  "
               f"H3: {np.mean(h3e):+6.1f}±{np.std(h3e):.1f}  "
-              f"combined={np.sqrt(np.mean(np.array(h2e)**2+np.array(h3e)**2)):.1f}")
+              f"combined={np.sqrt(np.mean(h2e**2+h3e**2)):.1f}")
 
     # ── Step 7: Summary ───────────────────────────────────────────────
     print(f"\n{'='*95}")
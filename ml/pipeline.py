@@ -5,7 +5,7 @@ Runs all stages in sequence:
 2. Score isolation
 3. Extract harmonics
 4. Render model notes (via Rust preamp-bench)
-5. Compute residuals -> training_data.npz
+5. Compute residuals -> ml_data/training_data/
 6. Train MLP
 7. Export weights to Rust
 
@@ -15,18 +15,26 @@ Usage:
     python pipeline.py --from-stage 3      # Resume from stage 3
     python pipeline.py --train             # Run stages 1-7 (including training)
     python pipeline.py --dry-run           # Show what would be done
+
+The JSON files handed between stages are written compactly (no indent);
+pretty-print one for inspection with `python -m json.tool notes.json`.
 """
 
 import argparse
 import json
+import multiprocessing
 import os
+import signal
 import sys
 import time
 
+# Lowest isolation tier stage 3 extracts (and stage 4 prerenders pairs for)
+HARMONICS_MIN_TIER = "bronze"
+
 
 def stage_extract_notes(args):
     """Stage 1: Extract note events from recordings."""
-    from extract_notes import extract_obm_notes, extract_polyphonic_notes, find_recordings
+    from extract_notes import extract_obm_notes, extract_all_polyphonic_notes, find_recordings
 
     all_notes = []
 
@@ -37,17 +45,11 @@ def stage_extract_notes(args):
     if not args.obm_only:
         recordings = find_recordings(args.input_dir)
         print(f"\nFound {len(recordings)} polyphonic recordings")
-        for rec_path in recordings:
-            try:
-                from extract_notes import extract_polyphonic_notes
-                notes = extract_polyphonic_notes(rec_path)
-                all_notes.extend(notes)
-            except Exception as e:
-                print(f"  ERROR: {e}")
+        all_notes.extend(extract_all_polyphonic_notes(recordings))
 
     output_path = os.path.join(os.path.dirname(__file__), "notes.json")
     with open(output_path, 'w') as f:
-        json.dump(all_notes, f, indent=2)
+        json.dump(all_notes, f, separators=(",", ":"))
     print(f"\nStage 1 complete: {len(all_notes)} notes -> notes.json")
     return all_notes
 
@@ -65,7 +67,7 @@ def stage_score_isolation(args):
 
     output_path = os.path.join(os.path.dirname(__file__), "scored_notes.json")
     with open(output_path, 'w') as f:
-        json.dump(notes, f, indent=2)
+        json.dump(notes, f, separators=(",", ":"))
     print(f"\nStage 2 complete: {len(notes)} notes scored -> scored_notes.json")
     return notes
 
@@ -78,18 +80,57 @@ def stage_extract_harmonics(args):
     with open(input_path) as f:
         notes = json.load(f)
 
-    features = extract_all_harmonics(notes, min_tier="bronze")
+    features = extract_all_harmonics(notes, min_tier=HARMONICS_MIN_TIER)
     print_summary(features)
 
     output_path = os.path.join(os.path.dirname(__file__), "harmonics.json")
     with open(output_path, 'w') as f:
-        json.dump(features, f, indent=2)
+        json.dump(features, f, separators=(",", ":"))
     print(f"\nStage 3 complete: {len(features)} features -> harmonics.json")
     return features
 
 
+def _prerender_worker_init():
+    """Pool initializer for prerender_model_notes' worker process.
+
+    Puts the worker in its own process group and makes SIGTERM (sent by
+    Pool.terminate) kill that whole group, so the cargo / preamp-bench
+    renders it started stop with it instead of running on orphaned.
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+        signal.signal(signal.SIGTERM, lambda signum, frame: os.killpg(0, signal.SIGKILL))
+
+
+def prerender_model_notes(cargo_features=None):
+    """Stage 4's renders, run in the background while stage 3 extracts harmonics.
+
+    A render depends only on its (midi, velocity) pair, and the scored notes
+    stage 3 will extract already give every pair harmonics.json can contain
+    (plus any whose extraction then fails). Returns render_all_notes' dict.
+    """
+    from extract_harmonics import TIER_ORDER
+    from render_model_notes import collect_unique_pairs, render_all_notes
+
+    input_path = os.path.join(os.path.dirname(__file__), "scored_notes.json")
+    with open(input_path) as f:
+        notes = json.load(f)
+
+    # Same tier filter as stage 3
+    eligible = [n for n in notes
+                if TIER_ORDER.get(n.get("isolation_tier", "reject"), 0)
+                >= TIER_ORDER[HARMONICS_MIN_TIER]]
+    render_dir = os.path.join(os.path.dirname(__file__), "ml_data", "renders")
+    return render_all_notes(collect_unique_pairs(eligible), render_dir, cargo_features)
+
+
 def stage_render_model(args):
-    """Stage 4: Render model notes and extract features."""
+    """Stage 4: Render model notes and extract features.
+
+    Uses the renders of args.prerender (a prerender_model_notes AsyncResult)
+    when main() started them alongside stage 3; pairs those renders lack are
+    rendered here.
+    """
     from render_model_notes import collect_unique_pairs, render_all_notes, extract_model_features
 
     input_path = os.path.join(os.path.dirname(__file__), "harmonics.json")
@@ -103,7 +144,17 @@ def stage_render_model(args):
     render_dir = os.path.join(ml_data_dir, "renders")
 
     cargo_features = getattr(args, 'cargo_features', None)
-    wav_paths = render_all_notes(pairs, render_dir, cargo_features)
+    prerender = getattr(args, 'prerender', None)
+    if prerender is not None:
+        print("  Waiting for renders started with stage 3...")
+        rendered = prerender.get()
+        wav_paths = {pair: rendered[pair] for pair in pairs if pair in rendered}
+        missing = [pair for pair in pairs if pair not in rendered]
+        if missing:
+            print(f"  {len(missing)} pairs missing from the background renders, rendering now")
+            wav_paths.update(render_all_notes(missing, render_dir, cargo_features))
+    else:
+        wav_paths = render_all_notes(pairs, render_dir, cargo_features)
     if not wav_paths:
         print("ERROR: No notes rendered")
         sys.exit(1)
@@ -116,32 +167,27 @@ def stage_render_model(args):
 
     output_path = os.path.join(os.path.dirname(__file__), "model_harmonics.json")
     with open(output_path, 'w') as f:
-        json.dump(output_data, f, indent=2)
+        json.dump(output_data, f, separators=(",", ":"))
     print(f"\nStage 4 complete: {len(output_data)} model features -> model_harmonics.json")
     return output_data
 
 
 def stage_compute_residuals(args):
     """Stage 5: Compute residuals and assemble training data."""
-    from compute_residuals import assemble_dataset, print_dataset_summary
-    import numpy as np
+    from compute_residuals import (assemble_dataset, load_feature_columns,
+                                   print_dataset_summary, save_training_data)
 
     base_dir = os.path.dirname(__file__)
-    with open(os.path.join(base_dir, "harmonics.json")) as f:
-        real_features = json.load(f)
-    with open(os.path.join(base_dir, "model_harmonics.json")) as f:
-        model_features = json.load(f)
+    real_features = load_feature_columns(os.path.join(base_dir, "harmonics.json"))
+    model_features = load_feature_columns(os.path.join(base_dir, "model_harmonics.json"))
 
     inputs, targets, mask, weights, note_ids, filter_stats = assemble_dataset(
         real_features, model_features)
 
     print_dataset_summary(inputs, targets, mask, weights, note_ids, filter_stats)
 
-    output_dir = os.path.join(base_dir, "ml_data")
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, "training_data.npz")
-    np.savez(output_path, inputs=inputs, targets=targets, mask=mask, weights=weights)
-    print(f"\nStage 5 complete: {inputs.shape[0]} observations -> ml_data/training_data.npz")
+    save_training_data(os.path.join(base_dir, "ml_data"), inputs, targets, mask, weights)
+    print(f"\nStage 5 complete: {inputs.shape[0]} observations -> ml_data/training_data/")
 
 
 def stage_train(args):
@@ -150,7 +196,7 @@ def stage_train(args):
     import torch
 
     base_dir = os.path.dirname(__file__)
-    data_path = os.path.join(base_dir, "ml_data", "training_data.npz")
+    data_path = os.path.join(base_dir, "ml_data", "training_data")
 
     print(f"Loading data from {data_path}...")
     train_data, val_data, target_means, target_stds = load_data(data_path)
@@ -249,22 +295,44 @@ def main():
         return
 
     total_start = time.time()
+    # Stage 4's Rust renders only need stage 2's output: overlap them with
+    # stage 3, in a spawned process so a failed stage can terminate them
+    render_pool = None
+    args.prerender = None
 
-    for num, name, func in STAGES:
-        if num > args.through_stage:
-            break
-        if num < args.from_stage:
-            print(f"\nStage {num}: {name} [SKIPPED]")
-            continue
-
-        print(f"\n{'=' * 70}")
-        print(f"  Stage {num}: {name}")
-        print(f"{'=' * 70}")
-
-        stage_start = time.time()
-        func(args)
-        elapsed = time.time() - stage_start
-        print(f"  Stage {num} took {elapsed:.1f}s")
+    try:
+        for num, name, func in STAGES:
+            if num > args.through_stage:
+                break
+            if num < args.from_stage:
+                print(f"\nStage {num}: {name} [SKIPPED]")
+                continue
+
+            print(f"\n{'=' * 70}")
+            print(f"  Stage {num}: {name}")
+            print(f"{'=' * 70}")
+
+            if num == 3 and args.through_stage >= 4:
+                print("  Rendering stage 4 model notes in the background")
+                render_pool = multiprocessing.get_context("spawn").Pool(
+                    1, initializer=_prerender_worker_init)
+                args.prerender = render_pool.apply_async(
+                    prerender_model_notes, (getattr(args, 'cargo_features', None),))
+
+            stage_start = time.time()
+            func(args)
+            elapsed = time.time() - stage_start
+            print(f"  Stage {num} took {elapsed:.1f}s")
+
+            if num == 4 and render_pool is not None:
+                render_pool.close()
+                render_pool.join()
+                render_pool = None
+    finally:
+        # Only reached with a live pool if a stage failed: stop the renders
+        if render_pool is not None:
+            render_pool.terminate()
+            render_pool.join()
 
     total_elapsed = time.time() - total_start
     print(f"\n{'=' * 70}")
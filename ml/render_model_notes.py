@@ -1,8 +1,9 @@
 """Render model notes to match real observations for residual computation.
 
 Collects unique (midi_note, velocity_bucket) pairs from the real note
-observations, then renders each one individually via the Rust preamp-bench
-CLI. Extracts identical harmonic features from model output.
+observations, then renders each one via the Rust preamp-bench CLI (batched
+through its render-batch subcommand). Extracts identical harmonic features
+from model output.
 
 The render path matches DI recordings: reed -> pickup -> preamp, bypassing
 power amp and speaker. This matches the OBM recording path (DI from preamp
@@ -13,14 +14,17 @@ Usage:
 """
 
 import argparse
+import hashlib
 import json
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 
-from goertzel_utils import load_audio, extract_harmonics_fft, amps_to_dB, midi_to_freq
-from extract_harmonics import WINDOWS, DECAY_TIMES, N_HARMONICS, rms
+from goertzel_utils import (load_audio, segment_spectra, harmonics_from_spectrum,
+                            amps_to_dB, midi_to_freq)
+from extract_harmonics import WINDOWS, DECAY_TIMES, N_HARMONICS, rms, json_floats
 
 # Velocity buckets: map continuous velocity to 8 discrete levels
 VELOCITY_BUCKETS = [20, 35, 50, 65, 80, 95, 110, 127]
@@ -30,20 +34,41 @@ NOTE_DURATION_S = 2.0
 
 PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..")
 
+# Binary left by render_all_notes' release build, run directly for batches
+BENCH_BIN = os.path.join(PROJECT_DIR, "target", "release",
+                         "preamp-bench.exe" if os.name == "nt" else "preamp-bench")
+
+# preamp-bench render options shared by every note: DI path, no MLP
+RENDER_ARGS = [
+    "--duration", str(NOTE_DURATION_S),
+    "--volume", "1.0",
+    "--no-poweramp",
+    "--no-mlp",
+    "--speaker", "0.0",
+]
+
 
 def bucket_velocity(velocity_midi):
     """Map a MIDI velocity to the nearest bucket value."""
     return min(VELOCITY_BUCKETS, key=lambda b: abs(b - velocity_midi))
 
 
+def bucket_velocity_array(velocity_midi):
+    """Vectorized bucket_velocity over an array of MIDI velocities.
+
+    Searches the midpoints between adjacent buckets; side='left' sends exact
+    midpoints to the lower bucket, matching bucket_velocity's tie-break.
+    """
+    buckets = np.asarray(VELOCITY_BUCKETS)
+    midpoints = (buckets[:-1] + buckets[1:]) / 2.0
+    return buckets[np.searchsorted(midpoints, velocity_midi, side='left')]
+
+
 def collect_unique_pairs(features):
     """Collect unique (midi_note, velocity_bucket) pairs from real observations."""
-    pairs = set()
-    for f in features:
-        midi = f["midi_note"]
-        vel = bucket_velocity(f.get("velocity_midi", 80))
-        pairs.add((midi, vel))
-    return sorted(pairs)
+    # Bucket every velocity in one vectorized pass
+    vels = bucket_velocity_array([f.get("velocity_midi", 80) for f in features])
+    return sorted(set(zip((f["midi_note"] for f in features), vels.tolist())))
 
 
 def render_note(midi, velocity, output_path, cargo_features=None):
@@ -64,11 +89,7 @@ def render_note(midi, velocity, output_path, cargo_features=None):
         "render",
         "--note", str(midi),
         "--velocity", str(velocity),
-        "--duration", str(NOTE_DURATION_S),
-        "--volume", "1.0",
-        "--no-poweramp",
-        "--no-mlp",
-        "--speaker", "0.0",
+        *RENDER_ARGS,
         "--output", output_path,
     ])
     result = subprocess.run(
@@ -83,10 +104,75 @@ def render_note(midi, velocity, output_path, cargo_features=None):
     return True
 
 
-def render_all_notes(pairs, output_dir, cargo_features=None):
-    """Render all (midi, vel) pairs, returning dict of WAV paths."""
+def render_batch(jobs):
+    """Render several notes in one preamp-bench render-batch process.
+
+    jobs is a list of (midi, velocity, output_path). Runs the release binary
+    directly, skipping cargo run's per-call startup, so render_all_notes must
+    have built it first. A nonzero exit counts every note as failed, since a
+    note may have been cut off mid-write.
+
+    Returns the set of (midi, velocity) pairs whose WAV was written.
+    """
+    if not jobs:
+        return set()
+    # Stale WAVs from an earlier run must not pass for fresh renders
+    for _, _, output_path in jobs:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    spec = "".join(f"{midi} {velocity} {output_path}\n" for midi, velocity, output_path in jobs)
+    try:
+        result = subprocess.run(
+            [BENCH_BIN, "render-batch", "--spec", "-", *RENDER_ARGS],
+            input=spec, capture_output=True, text=True,
+            cwd=PROJECT_DIR
+        )
+    except OSError as e:
+        print(f"  RENDER BATCH FAILED ({len(jobs)} notes): {e}")
+        return set()
+    if result.returncode != 0:
+        print(f"  RENDER BATCH FAILED ({len(jobs)} notes):")
+        print(f"    {result.stderr[:500]}")
+        return set()
+    return {(midi, velocity) for midi, velocity, output_path in jobs
+            if os.path.exists(output_path)}
+
+
+def render_signature(midi, velocity):
+    """Fingerprint of everything a render depends on, or None if not built.
+
+    Covers the note, RENDER_ARGS and the preamp-bench binary, whose mtime
+    and size change whenever cargo relinks it (source or --features change).
+    """
+    try:
+        st = os.stat(BENCH_BIN)
+    except OSError:
+        return None
+    key = f"{midi}|{velocity}|{' '.join(RENDER_ARGS)}|{st.st_mtime_ns}|{st.st_size}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def render_is_current(wav_path, signature):
+    """True if wav_path exists and its .sig sidecar matches signature."""
+    if signature is None or not os.path.exists(wav_path):
+        return False
+    try:
+        with open(wav_path + ".sig") as f:
+            return f.read() == signature
+    except OSError:
+        return False
+
+
+def render_all_notes(pairs, output_dir, cargo_features=None, workers=None, force=False):
+    """Render all (midi, vel) pairs, returning dict of WAV paths.
+
+    WAVs whose .sig sidecar matches render_signature() are reused as-is
+    unless force is set. The rest are split across `workers` concurrent
+    render-batch processes (default: os.cpu_count()). Notes a batch failed
+    to produce are retried one preamp-bench render per note, also `workers`
+    at a time.
+    """
     os.makedirs(output_dir, exist_ok=True)
-    wav_paths = {}
 
     # Build once in release mode before rendering
     build_cmd = ["cargo", "build", "-p", "preamp-bench", "--release"]
@@ -103,17 +189,106 @@ def render_all_notes(pairs, output_dir, cargo_features=None):
         return {}
     print("  Build successful")
 
-    for i, (midi, vel) in enumerate(pairs):
-        wav_path = os.path.join(output_dir, f"model_{midi}_{vel}.wav")
-        print(f"  [{i+1}/{len(pairs)}] Rendering MIDI {midi:>3} vel {vel:>3}...", end="", flush=True)
+    targets = {(midi, vel): os.path.join(output_dir, f"model_{midi}_{vel}.wav")
+               for midi, vel in pairs}
+    signatures = {key: render_signature(*key) for key in targets}
+    current = set() if force else {key for key, wav_path in targets.items()
+                                   if render_is_current(wav_path, signatures[key])}
+    if current:
+        print(f"  Reusing {len(current)}/{len(pairs)} up-to-date renders")
+    todo = {key: wav_path for key, wav_path in targets.items() if key not in current}
+    for wav_path in todo.values():
+        if os.path.exists(wav_path + ".sig"):
+            os.remove(wav_path + ".sig")
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    # One render-batch process per worker, notes dealt out round-robin
+    jobs = [(midi, vel, wav_path) for (midi, vel), wav_path in todo.items()]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rendered = set().union(*pool.map(render_batch, [jobs[i::workers] for i in range(workers)]))
+    if todo:
+        print(f"  Batch rendered {len(rendered)}/{len(todo)} notes")
+
+    missing = {key: wav_path for key, wav_path in todo.items() if key not in rendered}
+    if missing:
+        print(f"  Rendering {len(missing)} notes individually...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_note, midi, vel, wav_path, cargo_features): (midi, vel)
+                   for (midi, vel), wav_path in missing.items()}
+        # Progress is reported in completion order, from this thread only
+        for i, future in enumerate(as_completed(futures)):
+            midi, vel = futures[future]
+            ok = future.result()
+            if ok:
+                rendered.add((midi, vel))
+            print(f"  [{i+1}/{len(missing)}] Rendered MIDI {midi:>3} vel {vel:>3}... "
+                  f"{'OK' if ok else 'FAILED'}", flush=True)
+
+    for key in rendered:
+        if signatures[key] is not None:
+            with open(targets[key] + ".sig", 'w') as f:
+                f.write(signatures[key])
+
+    rendered |= current
+    return {key: wav_path for key, wav_path in targets.items() if key in rendered}
+
+
+def model_segment_bounds(n_samples, sr):
+    """Sample bounds of the analysis segments of a rendered note.
+
+    Renders start at t=0 and last the whole file, so unlike
+    extract_harmonics.note_segment_bounds there is no onset offset or
+    minimum-duration check. Returns (window_bounds, decay_bounds): each
+    WINDOWS name / DECAY_TIMES point maps to a (start, end) or None.
+    """
+    note_duration = n_samples / sr
 
-        if render_note(midi, vel, wav_path, cargo_features):
-            wav_paths[(midi, vel)] = wav_path
-            print(" OK")
+    window_bounds = {}
+    for win_name, (win_start, win_end, min_dur) in WINDOWS.items():
+        window_bounds[win_name] = None
+        actual_end = min(win_end, note_duration)
+        if win_start >= actual_end:
+            continue
+        start_idx = int(win_start * sr)
+        end_idx = int(actual_end * sr)
+        if end_idx - start_idx < 128:
+            continue
+        window_bounds[win_name] = (start_idx, end_idx)
+
+    decay_bounds = []
+    for t in DECAY_TIMES:
+        start_idx = int(t * sr)
+        end_idx = min(int((t + 0.100) * sr), n_samples)
+        if t >= note_duration - 0.05 or end_idx - start_idx < 64:
+            decay_bounds.append(None)
         else:
-            print(" FAILED")
+            decay_bounds.append((start_idx, end_idx))
+
+    return window_bounds, decay_bounds
+
+
+def decay_rates(h1_amps):
+    """Log-linear decay slope of H1 for many notes in one vectorized pass.
+
+    h1_amps holds one row of DECAY_TIMES amplitudes (None = not measured)
+    per note. Each row is fitted by least squares, log10(amp) = slope * t +
+    intercept, over its points above 1e-15, in closed form.
 
-    return wav_paths
+    Returns an array of slopes (log10 units/s), NaN for rows with fewer
+    than 3 valid points.
+    """
+    amps = np.array([[np.nan if a is None else a for a in row] for row in h1_amps],
+                    dtype=float).reshape(-1, len(DECAY_TIMES))
+    valid = amps > 1e-15  # NaN compares False
+    n = valid.sum(axis=1)
+    times = np.where(valid, np.asarray(DECAY_TIMES), 0.0)
+    log_amps = np.log10(np.where(valid, amps, 1.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dt = np.where(valid, times - (times.sum(axis=1) / n)[:, None], 0.0)
+        dy = log_amps - (log_amps.sum(axis=1) / n)[:, None]
+        sxx = (dt * dt).sum(axis=1)
+        slope = (dt * dy).sum(axis=1) / sxx
+    return np.where((n >= 3) & (sxx > 0), slope, np.nan)
 
 
 def extract_model_features(wav_paths, pairs):
@@ -148,59 +323,39 @@ def extract_model_features(wav_paths, pairs):
             "windows": {},
         }
 
-        # Extract harmonics at each window
-        for win_name, (win_start, win_end, min_dur) in WINDOWS.items():
-            actual_end = min(win_end, note_duration)
-            if win_start >= actual_end:
-                feat["windows"][win_name] = None
-                continue
-
-            start_idx = int(win_start * sr)
-            end_idx = int(actual_end * sr)
-            segment = audio[start_idx:end_idx]
+        window_bounds, decay_bounds = model_segment_bounds(len(audio), sr)
+        # Equal-length segments (the decay points) share one stacked rfft
+        spectra = segment_spectra(audio, sr, filter(None, [*window_bounds.values(), *decay_bounds]))
 
-            if len(segment) < 128:
+        # Extract harmonics at each window
+        for win_name, b in window_bounds.items():
+            if b is None:
                 feat["windows"][win_name] = None
                 continue
 
-            amps, freqs = extract_harmonics_fft(segment, sr, f0, N_HARMONICS)
+            amps, freqs = harmonics_from_spectrum(*spectra[b], sr, f0, N_HARMONICS)
             dB = amps_to_dB(amps)
 
             feat["windows"][win_name] = {
-                "amps_linear": [round(float(a), 8) for a in amps],
-                "amps_dB_rel_H1": [round(float(d), 2) for d in dB],
-                "freqs_hz": [round(float(f), 2) for f in freqs],
+                "amps_linear": json_floats(amps, 8),
+                "amps_dB_rel_H1": json_floats(dB, 2),
+                "freqs_hz": json_floats(freqs, 2),
             }
 
         # Decay rate
         decay_amps = []
-        for t in DECAY_TIMES:
-            if t >= note_duration - 0.05:
-                decay_amps.append(None)
-                continue
-            start_idx = int(t * sr)
-            end_idx = min(int((t + 0.100) * sr), len(audio))
-            if end_idx - start_idx < 64:
+        for b in decay_bounds:
+            if b is None:
                 decay_amps.append(None)
                 continue
-            segment = audio[start_idx:end_idx]
-            h1_amp = extract_harmonics_fft(segment, sr, f0, 1)[0][0]
+            h1_amp = harmonics_from_spectrum(*spectra[b], sr, f0, 1)[0][0]
             decay_amps.append(round(float(h1_amp), 8))
 
-        valid_points = [(t, a) for t, a in zip(DECAY_TIMES, decay_amps)
-                        if a is not None and a > 1e-15]
-        decay_rate = None
-        if len(valid_points) >= 3:
-            times = np.array([p[0] for p in valid_points])
-            log_amps = np.log10(np.array([p[1] for p in valid_points]))
-            if np.std(times) > 0:
-                slope, _ = np.polyfit(times, log_amps, 1)
-                decay_rate = round(float(-20.0 * slope), 2)
-
+        # decay_rate_dB_s is fitted for all pairs at once, after this loop
         feat["decay"] = {
             "times_s": DECAY_TIMES,
             "h1_amps": decay_amps,
-            "decay_rate_dB_s": decay_rate,
+            "decay_rate_dB_s": None,
         }
 
         # Overshoot
@@ -234,6 +389,11 @@ def extract_model_features(wav_paths, pairs):
 
         features[key] = feat
 
+    rates = decay_rates([feat["decay"]["h1_amps"] for feat in features.values()])
+    for feat, rate in zip(features.values(), rates.tolist()):
+        if not np.isnan(rate):
+            feat["decay"]["decay_rate_dB_s"] = round(-20.0 * rate, 2)
+
     return features
 
 
@@ -247,6 +407,10 @@ def main():
                         help="Directory for rendered WAVs (default: ml_data/renders)")
     parser.add_argument("--cargo-features", default=None,
                         help="Cargo features to pass to preamp-bench (e.g. melange-preamp)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Concurrent note renders (default: all cores)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-render notes even if their WAV is up to date")
     args = parser.parse_args()
 
     input_path = os.path.join(os.path.dirname(__file__), args.input)
@@ -264,7 +428,8 @@ def main():
 
     # Render all notes
     print(f"\nRendering {len(pairs)} notes...")
-    wav_paths = render_all_notes(pairs, render_dir, args.cargo_features)
+    wav_paths = render_all_notes(pairs, render_dir, args.cargo_features, workers=args.workers,
+                                 force=args.force)
     print(f"  Successfully rendered: {len(wav_paths)}/{len(pairs)}")
 
     if not wav_paths:
@@ -284,7 +449,7 @@ def main():
 
     output_path = os.path.join(os.path.dirname(__file__), args.output)
     with open(output_path, 'w') as f:
-        json.dump(output_data, f, indent=2)
+        json.dump(output_data, f, separators=(",", ":"))
     print(f"\nSaved to {output_path}")
 
 
@@ -348,7 +348,7 @@ def main():
 
     output_path = os.path.join(os.path.dirname(__file__), args.output)
     with open(output_path, 'w') as f:
-        json.dump(notes, f, indent=2)
+        json.dump(notes, f, separators=(",", ":"))
     print(f"\nSaved to {output_path}")
 
 
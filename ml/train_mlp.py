@@ -70,6 +70,27 @@ def masked_huber_loss(pred, target, mask, weights, delta=5.0):
     return torch.tensor(0.0)
 
 
+def load_training_arrays(data_path):
+    """Load (inputs, targets, mask, weights) from compute_residuals output.
+
+    data_path is a training_data/ directory of .npy files, which are
+    memory-mapped read-only (the bit-packed mask is unpacked into memory),
+    or a legacy training_data.npz.
+    """
+    names = ('inputs', 'targets', 'mask', 'weights')
+    if os.path.isdir(data_path):
+        def load(name):
+            return np.load(os.path.join(data_path, f"{name}.npy"), mmap_mode='r')
+        inputs, targets, weights = load('inputs'), load('targets'), load('weights')
+        if os.path.exists(os.path.join(data_path, "mask_packed.npy")):
+            mask = np.unpackbits(load('mask_packed'), axis=1, count=targets.shape[1]).astype(bool)
+        else:
+            mask = load('mask')
+        return inputs, targets, mask, weights
+    d = np.load(data_path)
+    return tuple(d[name] for name in names)
+
+
 def load_data(data_path, no_split=False, mask_decay_h3=False):
     """Load and preprocess training data.
 
@@ -77,11 +98,10 @@ def load_data(data_path, no_split=False, mask_decay_h3=False):
     If no_split=True (for small datasets), train=val=all data.
     If mask_decay_h3=True, zero out the decay_H3 mask (too noisy to train on).
     """
-    d = np.load(data_path)
-    inputs = d['inputs']    # (N, 2) already normalized [0,1]
-    targets = d['targets']  # (N, 11)
-    mask = d['mask']        # (N, 11) bool
-    weights = d['weights']  # (N,)
+    inputs, targets, mask, weights = load_training_arrays(data_path)
+    # inputs (N, 2) already normalized [0,1]; weights (N,)
+    targets = np.array(targets)  # (N, 11), clipped in place below
+    mask = np.array(mask)        # (N, 11) bool, optionally edited below
 
     n_targets = targets.shape[1]
 
@@ -272,8 +292,8 @@ def export_weights(model, target_means, target_stds, hidden_size, output_path):
 
 def main():
     parser = argparse.ArgumentParser(description="Train MLP for parameter corrections")
-    parser.add_argument("--data", default="ml_data/training_data.npz",
-                        help="Training data path")
+    parser.add_argument("--data", default="ml_data/training_data",
+                        help="Training data directory (or legacy .npz)")
     parser.add_argument("--epochs", type=int, default=2000)
     parser.add_argument("--lr", type=float, default=3e-3)
     parser.add_argument("--hidden", type=int, default=8)
@@ -8,6 +8,7 @@
 //!   preamp-bench harmonics [--freq F] [--amplitude A]
 //!   preamp-bench tremolo-sweep [--ldr-min R1] [--ldr-max R2] [--steps N] [--csv FILE]
 //!   preamp-bench render [--note N] [--velocity V] [--duration D] [--output FILE]
+//!   preamp-bench render-batch [--spec FILE|-] [render options...]
 
 use std::f64::consts::PI;
 use std::io::Write;
@@ -40,6 +41,7 @@ fn main() {
         "harmonics" => cmd_harmonics(&args[2..]),
         "tremolo-sweep" => cmd_tremolo_sweep(&args[2..]),
         "render" => cmd_render(&args[2..]),
+        "render-batch" => cmd_render_batch(&args[2..]),
         "bark-audit" => cmd_bark_audit(&args[2..]),
         "intermod-audit" => cmd_intermod_audit(&args[2..]),
         "alias-audit" => cmd_alias_audit(&args[2..]),
@@ -71,6 +73,7 @@ fn print_usage() {
     eprintln!("  harmonics       Measure harmonic distortion (H2/H3)");
     eprintln!("  tremolo-sweep   Gain vs LDR resistance sweep");
     eprintln!("  render          Reed -> preamp -> WAV output");
+    eprintln!("  render-batch    `render` for many notes in one process (NOTE VEL OUTPUT lines)");
     eprintln!("  bark-audit      Measure H2/H1 at each signal chain stage");
     eprintln!("  intermod-audit  Detect inharmonic intermodulation beating risk");
     eprintln!("  alias-audit     Detect power-amp click-band aliasing (H6-H11 plateau + HF hash)");
@@ -548,6 +551,78 @@ fn cmd_render(args: &[String]) {
     println!("  Output:    {output_path}");
 }
 
+// ─── Batch render ───────────────────────────────────────────────────────────
+
+/// Run `render` for every line of a spec, in one process.
+///
+/// Each non-empty, non-`#` line is `NOTE VELOCITY OUTPUT` (the output path
+/// may contain spaces). The spec is read from `--spec FILE`, or stdin for
+/// `-` (the default). Every other flag is shared by all notes and means the
+/// same as for `render`. Exits 1 if any line could not be parsed.
+fn cmd_render_batch(args: &[String]) {
+    let spec_path = parse_flag_str(args, "--spec", "-");
+    let spec = if spec_path == "-" {
+        let mut buf = String::new();
+        std::io::Read::read_to_string(&mut std::io::stdin(), &mut buf)
+            .expect("Failed to read spec from stdin");
+        buf
+    } else {
+        std::fs::read_to_string(spec_path).expect("Failed to read spec file")
+    };
+
+    let mut bad_lines = 0;
+    for (lineno, line) in spec.lines().enumerate() {
+        match parse_spec_line(line) {
+            Ok(None) => {}
+            Ok(Some((note, velocity, output))) => {
+                // parse_flag takes the first match, so per-note values go first
+                let mut note_args: Vec<String> = vec![
+                    "--note".into(),
+                    note.to_string(),
+                    "--velocity".into(),
+                    velocity.to_string(),
+                    "--output".into(),
+                    output.into(),
+                ];
+                note_args.extend_from_slice(args);
+                cmd_render(&note_args);
+            }
+            Err(()) => {
+                eprintln!(
+                    "render-batch: bad spec line {}: {}",
+                    lineno + 1,
+                    line.trim()
+                );
+                bad_lines += 1;
+            }
+        }
+    }
+    if bad_lines > 0 {
+        std::process::exit(1);
+    }
+}
+
+/// Parse one `render-batch` spec line into (note, velocity, output path).
+///
+/// Blank and `#` lines give `Ok(None)`. Note and velocity must parse as
+/// `u8`: passing them on unchecked would let `parse_flag` fall back to its
+/// defaults and render the wrong note under the requested file name.
+fn parse_spec_line(line: &str) -> Result<Option<(u8, u8, &str)>, ()> {
+    let line = line.trim();
+    if line.is_empty() || line.starts_with('#') {
+        return Ok(None);
+    }
+    let mut fields = line.splitn(3, char::is_whitespace);
+    match (fields.next(), fields.next(), fields.next()) {
+        (Some(note), Some(velocity), Some(output)) if !output.trim().is_empty() => {
+            let note = note.parse().map_err(|_| ())?;
+            let velocity = velocity.parse().map_err(|_| ())?;
+            Ok(Some((note, velocity, output.trim())))
+        }
+        _ => Err(()),
+    }
+}
+
 // ─── Bark audit ─────────────────────────────────────────────────────────────
 
 /// Measure H2/H1 at every stage of the signal chain to diagnose bark deficiency.
@@ -3061,3 +3136,37 @@ fn cmd_pump_sinusoid(args: &[String]) {
     eprintln!("  bifurcation events (pair-step > 0.1 V): {bifurcs}  (expect 0 for slewed-R)");
     eprintln!("pump-sinusoid: done in {secs:.1}s → {csv_path}");
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn spec_line_parses_note_velocity_and_path() {
+        assert_eq!(
+            parse_spec_line("60 80 /tmp/model_60_80.wav"),
+            Ok(Some((60, 80, "/tmp/model_60_80.wav")))
+        );
+        // Output path keeps inner spaces; surrounding whitespace is dropped
+        assert_eq!(
+            parse_spec_line("  61\t95 /tmp/my renders/a.wav \r"),
+            Ok(Some((61, 95, "/tmp/my renders/a.wav")))
+        );
+    }
+
+    #[test]
+    fn spec_line_skips_blank_and_comment_lines() {
+        assert_eq!(parse_spec_line(""), Ok(None));
+        assert_eq!(parse_spec_line("   "), Ok(None));
+        assert_eq!(parse_spec_line("# note vel path"), Ok(None));
+    }
+
+    #[test]
+    fn spec_line_rejects_malformed_fields() {
+        assert_eq!(parse_spec_line("6O 1OO out.wav"), Err(()));
+        assert_eq!(parse_spec_line("60 300 out.wav"), Err(()));
+        assert_eq!(parse_spec_line("-1 80 out.wav"), Err(()));
+        assert_eq!(parse_spec_line("60 80"), Err(()));
+        assert_eq!(parse_spec_line("60"), Err(()));
+    }
+}